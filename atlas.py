@@ -0,0 +1,124 @@
+"""Build the sprite atlas the pygame client loads at startup.
+
+    python atlas.py                  # writes sprites.atlas
+    python atlas.py --output kiosk.atlas
+
+Every sprite folder the client draws is decoded and scaled once here, and
+the raw RGBA pixels are packed back to back in one file after a JSON index.
+The client memory-maps that file and wraps each frame in a surface without
+decoding a PNG. Rebuild after changing any sprite, the client falls back to
+the PNGs for a folder whose files no longer match the index.
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+
+import pygame
+
+MAGIC = b"SPRITE-ATLAS 1\n"
+INDEX_LENGTH = struct.Struct("!I")  # JSON index follows, then the pixel data
+DEFAULT_PATH = "sprites.atlas"
+
+# Every sprite folder clean_game_client.py loads, at the size it draws it
+SPRITE_SETS = [
+    ("individual_sprites/01_demon_idle", (500, 500)),
+    ("individual_sprites/03_demon_cleave", (500, 500)),
+    ("individual_sprites/04_demon_take_hit", (500, 500)),
+    ("individual_sprites/05_demon_death", (500, 500)),
+    ("sword_sprites/sword_idle", (300, 300)),
+    ("sword_sprites/sword_combo", (300, 300)),
+]
+
+
+def entry_key(folder, size):
+    return f"{folder}@{size[0]}x{size[1]}"
+
+
+def source_files(folder):
+    """The PNGs of a folder in load order, with what identifies their version."""
+    return [
+        [entry.name, entry.stat().st_size, entry.stat().st_mtime_ns]
+        for entry in sorted(os.scandir(folder), key=lambda entry: entry.name)
+        if entry.name.endswith(".png")
+    ]
+
+
+def build(path, sprite_sets=SPRITE_SETS):
+    index = {}
+    chunks = []
+    offset = 0
+    for folder, size in sprite_sets:
+        sources = source_files(folder)
+        offsets = []
+        for name, _, _ in sources:
+            frame = pygame.image.load(os.path.join(folder, name))
+            frame = pygame.transform.scale(frame, size)
+            pixels = pygame.image.tobytes(frame, "RGBA")
+            chunks.append(pixels)
+            offsets.append(offset)
+            offset += len(pixels)
+        index[entry_key(folder, size)] = {"sources": sources, "offsets": offsets}
+
+    header = json.dumps(index).encode()
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + INDEX_LENGTH.pack(len(header)) + header)
+        for pixels in chunks:
+            f.write(pixels)
+    os.replace(tmp_path, path)  # A running client never sees a half-written atlas
+    return len(chunks), offset
+
+
+class Atlas:
+    """A built atlas, mapped into memory. Frames are only copied when they
+    are converted to the display's pixel format."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a sprite atlas")
+        start = len(MAGIC) + INDEX_LENGTH.size
+        (length,) = INDEX_LENGTH.unpack_from(self.map, len(MAGIC))
+        self.index = json.loads(self.map[start : start + length])
+        self.data = memoryview(self.map)[start + length :]
+
+    def frames(self, folder, size):
+        """Surfaces for every frame of a folder at size, None if the atlas
+        doesn't have it or the PNGs changed since it was built."""
+        entry = self.index.get(entry_key(folder, size))
+        if entry is None or entry["sources"] != source_files(folder):
+            return None
+        frame_bytes = size[0] * size[1] * 4
+        return [
+            pygame.image.frombuffer(
+                self.data[offset : offset + frame_bytes], size, "RGBA"
+            ).convert_alpha()
+            for offset in entry["offsets"]
+        ]
+
+
+def open_atlas(path=DEFAULT_PATH):
+    """The atlas at path, or None to load sprites from the PNGs."""
+    try:
+        return Atlas(path)
+    except FileNotFoundError:
+        return None
+    except (ValueError, struct.error) as e:
+        print(f"Ignoring sprite atlas {path}: {e}")
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", default=DEFAULT_PATH)
+    args = parser.parse_args()
+    frames, nbytes = build(args.output)
+    print(f"Wrote {frames} frames, {nbytes / 1e6:.1f} MB of pixels, to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
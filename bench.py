@@ -0,0 +1,441 @@
+"""Micro-benchmarks for the protocol, parsing, ranking and rendering hot paths.
+
+Every benchmark runs its function in a calibrated loop after a warmup, and
+reports per-operation times over several repetitions. Save a run as JSON
+and compare a later run against it:
+
+    python bench.py --json before.json
+    python bench.py --compare before.json
+    python bench.py -k render
+"""
+
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import platform
+import socket
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+
+# Rendering benchmarks need a display surface but no window or sound
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+BENCHMARKS = {}  # name -> setup function returning (callable, operations per call)
+DISCARD_ADDR = ("127.0.0.1", 9)  # Datagrams sent by benchmarks go nowhere
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def measure(func, ops, repeat, warmup, min_time):
+    """Per-operation seconds of each repetition, after warmup repetitions."""
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()  # Calls taking at least 0.2 s
+    number = max(1, round(number * min_time / max(elapsed, 1e-9)))
+    for _ in range(warmup):
+        timer.timeit(number)
+    return number, [timer.timeit(number) / number / ops for _ in range(repeat)]
+
+
+def summarize(number, ops, times):
+    return {
+        "loops": number,
+        "ops_per_call": ops,
+        "repeat": len(times),
+        "min_us": min(times) * 1e6,
+        "median_us": statistics.median(times) * 1e6,
+        "mean_us": statistics.fmean(times) * 1e6,
+        "stdev_us": statistics.stdev(times) * 1e6 if len(times) > 1 else 0.0,
+    }
+
+
+# Parsing and protocol
+
+
+@benchmark("client.data_extraction")
+def bench_data_extraction(args):
+    import clean_client
+
+    # Mappings clean_client.py sets up under __main__
+    clean_client.MIN_X_VAL, clean_client.MAX_X_VAL = 0, 7000
+    clean_client.MIN_Y_VAL, clean_client.MAX_Y_VAL = 0, 7000
+    line = " ".join(f"0x{value:08x}" for value in (0x1F, 0x80, 0x44, 0xA0, 0x7F, 0x10))
+    return lambda: clean_client.data_extraction(line), 1
+
+
+def snapshot_stream(count):
+    """A keyframe followed by deltas, as one room sends them to a client."""
+    from protocol import encode_snapshot, snapshot_mask
+
+    datagrams = []
+    state = None
+    for seq in range(1, count + 1):
+        new_state = (
+            3000 - seq % 300 * 10,
+            seq % 90 - 45,
+            seq // 7,
+            seq // 11,
+            (seq * 37) % 900 - 450,
+            (seq * 53) % 900 - 450,
+            seq & 0x03,
+        )
+        mask = snapshot_mask(state, new_state)
+        baseline_seq = seq - 1 if state else 0
+        datagrams.append(encode_snapshot(0, seq, baseline_seq, mask, new_state))
+        state = new_state
+    return datagrams
+
+
+@benchmark("game_client.dispatch_snapshot")
+def bench_dispatch_snapshot(args):
+    client = game_client()
+    datagrams = snapshot_stream(1024)
+
+    def run():
+        client.latest_snapshot_seq = 0
+        client.snapshot_history.clear()
+        for data in datagrams:
+            client.handle_datagram(data)
+
+    return run, len(datagrams)
+
+
+@benchmark("game_client.dispatch_high_scores")
+def bench_dispatch_high_scores(args):
+    from protocol import HIGH_SCORES, encode
+
+    client = game_client()
+    games = [
+        {
+            "game_id": 1_700_000_000_000_00 + i,
+            "room_id": i,
+            "player_1_score": 400 - i,
+            "player_2_score": 350 - i,
+            "timestamp": "2025-03-14T15:09:26.535897",
+        }
+        for i in range(5)
+    ]
+    games.append(dict(games[-1], rank=4711))
+    payload = json.dumps(games).encode()
+    seqs = itertools.count(1)
+
+    def run():
+        # A fresh sequence number each time, repeats are dropped as duplicates
+        client.handle_datagram(encode(HIGH_SCORES, 0, next(seqs), payload))
+
+    return run, 1
+
+
+# Server fan-out
+
+
+def game_server():
+    import clean_info_server_official as server
+
+    if getattr(server, "fanout", None) is None:
+        from fanout import FanOut
+
+        server.fanout = FanOut(socket.socket(socket.AF_INET, socket.SOCK_DGRAM))
+    if getattr(server, "control", None) is None:
+        from reliable import ReliableChannel
+
+        server.control = ReliableChannel()
+    return server
+
+
+def server_room(members):
+    from rooms import Room
+
+    room = Room(1)
+    for i in range(members):
+        room.join(("127.0.0.1", 20000 + i), i % 2 + 1 if members <= 2 else i + 1)
+    return room
+
+
+@benchmark("server.send_to_room_fanout")
+def bench_send_to_room(args):
+    from protocol import WAITING
+
+    server = game_server()
+    room = server_room(args.members)
+
+    def run():
+        server.send_to_room(room, WAITING, 1)
+        server.control.pending.clear()  # As if every member acked at once
+
+    return run, len(room.members)
+
+
+@benchmark("server.flush_snapshot")
+def bench_flush_snapshot(args):
+    server = game_server()
+    room = server_room(args.members)
+    server.UNACKED_DELTA_LIMIT = 1 << 30  # Keep sending deltas, nobody acks
+    ticks = itertools.count()
+
+    def run():
+        room.boss_hp = 3000 - next(ticks) % 300
+        room.dirty = True
+        server.flush_snapshot(room)
+
+    return run, len(room.members)
+
+
+# Leaderboard
+
+
+def synthetic_game(i):
+    return {
+        "game_id": i + 1,
+        "room_id": i % 64,
+        "player_1_score": (i * 7919) % 600,
+        "player_2_score": (i * 104729) % 600,
+        "timestamp": "2025-03-14T15:09:26.535897",
+    }
+
+
+def synthetic_history(size):
+    return [synthetic_game(i) for i in range(size)]
+
+
+@benchmark("leaderboard.memory_high_scores")
+def bench_memory_high_scores(args):
+    from leaderboard import Leaderboard
+
+    leaderboard = Leaderboard()
+    leaderboard.load(synthetic_history(args.history))
+    latest = args.history  # Newest game, usually outside the top 5
+    return lambda: leaderboard.high_scores(latest), 1
+
+
+@benchmark("leaderboard.memory_add")
+def bench_memory_add(args):
+    from leaderboard import Leaderboard
+
+    leaderboard = Leaderboard()
+    leaderboard.load(synthetic_history(args.history))
+    games = map(synthetic_game, itertools.count(args.history))
+    return lambda: leaderboard.add(next(games)), 1
+
+
+@benchmark("leaderboard.sqlite_high_scores")
+def bench_sqlite_high_scores(args):
+    from leaderboard import QueryLeaderboard
+    from storage import SQLiteStorage
+
+    path = os.path.join(tempfile.mkdtemp(prefix="bench-"), "bench.db")
+    storage = SQLiteStorage(path)
+    storage.create_tables()
+    history = synthetic_history(args.history)
+    storage.save_game_results(history)
+    leaderboard = QueryLeaderboard(storage)
+    leaderboard.add(history[-1])
+    return lambda: leaderboard.high_scores(history[-1]["game_id"]), 1
+
+
+# Rendering
+
+
+_game_client = None
+
+
+def game_client():
+    """clean_game_client.py with the globals its __main__ block sets up, on
+    the dummy SDL video driver."""
+    global _game_client
+    if _game_client is not None:
+        return _game_client
+    import pygame
+
+    import clean_game_client as client
+    from protocol import Reassembler
+    from render_cache import RotationCache, TextCache
+    from reliable import ReliableChannel
+
+    pygame.init()
+    client.WIDTH, client.HEIGHT = 800, 600
+    client.screen = pygame.display.set_mode((client.WIDTH, client.HEIGHT))
+    client.font = pygame.font.Font(None, 36)
+    client.texts = TextCache()
+    client.game_state = "playing"
+    client.player_id = 1
+    client.high_scores = []
+    client.latest_game = None
+    client.high_scores_surface = None
+    client.high_scores_dirty = False
+    client.waiting_for_other = False
+    client.SERVER_IP, client.SERVER_PORT = DISCARD_ADDR
+    client.ROOM_ID = 0
+    client.client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.client_socket.setblocking(False)
+    client.send_seq = 0
+    client.control = ReliableChannel()
+    client.control_seq = 0
+    client.reassembler = Reassembler()
+    client.RECT_WIDTH, client.RECT_HEIGHT = 120, 20
+    client.sprite_atlas = None
+    client.rotations = RotationCache()
+    client.players = {
+        1: {"angle": 0, "color": (255, 0, 0)},
+        2: {"angle": 0, "color": (255, 0, 0)},
+    }
+    client.scores = {1: 0, 2: 0}
+    client.overlay_angle = 0
+    client.snapshot_flags = 0
+    client.snapshot_history = {}
+    client.latest_snapshot_seq = 0
+    client.SNAPSHOT_HISTORY = 32
+    client.boss_hp = 3000
+    client.player_health = {1: 100, 2: 100}
+    client.enemy_attack = {1: False, 2: False}
+    client.enemy_attack_timer = {1: 0, 2: 0}
+    client.sword_idle = {
+        1: client.load_animation_frames(
+            os.path.join("sword_sprites", "sword_idle"), scale_size=(300, 300)
+        ),
+        2: client.load_animation_frames(
+            os.path.join("sword_sprites", "sword_idle"),
+            flip=True,
+            scale_size=(300, 300),
+        ),
+    }
+    client.sword_combo = {
+        1: client.load_animation_frames(
+            os.path.join("sword_sprites", "sword_combo"), scale_size=(300, 300)
+        ),
+        2: client.load_animation_frames(
+            os.path.join("sword_sprites", "sword_combo"),
+            flip=True,
+            scale_size=(300, 300),
+        ),
+    }
+    client.sword_states = {1: "idle", 2: "idle"}
+    client.sword_frame_index = {1: 0, 2: 0}
+    client.sword_last_update = {1: 0, 2: 0}
+    client.sword_animation_speed = 100
+    client.current_animation = "idle"
+    client.frame_index = 0
+    client.hit_timer = 0
+    _game_client = client
+    return client
+
+
+def player_angles():
+    """Angles the way snapshots deliver them, in tenths of a degree."""
+    return itertools.cycle([tenths / 10 for tenths in range(-450, 451, 7)])
+
+
+@benchmark("render.draw_tilting_rectangle")
+def bench_draw_tilting_rectangle(args):
+    client = game_client()
+    angles = player_angles()
+    pivot = (client.WIDTH // 4, client.HEIGHT // 2)
+    return lambda: client.draw_tilting_rectangle(pivot, next(angles), (0, 255, 0)), 1
+
+
+@benchmark("render.draw_overlay_rectangle")
+def bench_draw_overlay_rectangle(args):
+    client = game_client()
+    angles = itertools.cycle(range(-45, 46))  # Overlay angles are whole degrees
+    pivot = (client.WIDTH // 4, client.HEIGHT // 2)
+    return lambda: client.draw_overlay_rectangle(pivot, next(angles)), 1
+
+
+@benchmark("render.draw_high_scores")
+def bench_draw_high_scores(args):
+    client = game_client()
+    client.high_scores = [synthetic_game(i) for i in range(5)]
+    client.high_scores.append(dict(synthetic_game(5), rank=4711))
+    client.latest_game = client.high_scores[-1]
+    client.high_scores_dirty = True
+    return client.draw_high_scores, 1
+
+
+@benchmark("render.draw_sword")
+def bench_draw_sword(args):
+    client = game_client()
+    pivot = (client.WIDTH // 4, client.HEIGHT // 2)
+    client.sword_states[1] = "combo"
+    return lambda: client.draw_sword(1, pivot), 1
+
+
+def run(args):
+    results = {}
+    names = [name for name in BENCHMARKS if not args.k or args.k in name]
+    for name in names:
+        try:
+            func, ops = BENCHMARKS[name](args)
+        except ImportError as e:
+            print(f"{name:36} skipped ({e})")
+            continue
+        # The code under test prints, keep that out of the report
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            number, times = measure(func, ops, args.repeat, args.warmup, args.min_time)
+        results[name] = summary = summarize(number, ops, times)
+        print(
+            f"{name:36} {summary['median_us']:10.3f} us/op"
+            f"  (min {summary['min_us']:.3f}, stdev {summary['stdev_us']:.3f})"
+        )
+    return results
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)["benchmarks"]
+    print(f"\nCompared with {baseline_path} (median, lower is better):")
+    for name, summary in results.items():
+        if name in baseline:
+            ratio = summary["median_us"] / baseline[name]["median_us"]
+            print(f"{name:36} {ratio:6.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-k", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=7, help="Timed repetitions")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed repetitions")
+    parser.add_argument(
+        "--min-time", type=float, default=0.2, help="Seconds per repetition"
+    )
+    parser.add_argument(
+        "--history", type=int, default=100_000, help="Games in leaderboard benchmarks"
+    )
+    parser.add_argument(
+        "--members", type=int, default=2, help="Room members in fan-out benchmarks"
+    )
+    parser.add_argument("--json", metavar="PATH", help="Write the results as JSON")
+    parser.add_argument("--compare", metavar="PATH", help="JSON of an earlier run")
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))  # Sprite paths are relative
+    results = run(args)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {
+                    "python": sys.version,
+                    "platform": platform.platform(),
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "args": {k: v for k, v in vars(args).items() if k != "json"},
+                    "benchmarks": results,
+                },
+                f,
+                indent=2,
+            )
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
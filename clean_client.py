@@ -1,11 +1,24 @@
 import socket
 import threading
-import intel_jtag_uart
 import json
+import os
 import sys
 import time
 import queue
 import re
+import itertools
+
+from protocol import (
+    FRAME_EXIT,
+    FRAME_INFO_ERROR,
+    FRAME_INFO_RESPONSE,
+    MAX_INFO_IDS,
+    FrameReader,
+    decode_info_response,
+    encode_frame,
+    encode_info_request,
+    encode_samples,
+)
 
 
 def data_extraction(data):
@@ -22,34 +35,81 @@ def data_extraction(data):
 
 
 def receive_messages(client_socket):
+    reader = FrameReader()
     while True:
         try:
-            data = client_socket.recv(1024).decode("utf-8")
+            data = client_socket.recv(4096)
             if not data:
                 break
-            print(f"Server: {data}")
+            for kind, payload in reader.feed(data):
+                if kind in (FRAME_INFO_RESPONSE, FRAME_INFO_ERROR):
+                    request_id, body = decode_info_response(payload)
+                    with pending_lock:
+                        request = pending_requests.get(request_id)
+                    if request is not None:
+                        if kind == FRAME_INFO_ERROR:
+                            request[1] = RuntimeError(body.decode())
+                        else:
+                            request[1] = json.loads(body)
+                        request[0].set()
         except:
             print("\nDisconnected from server.")
             break
 
 
-def query_game_info(client_socket, game_id):
-    client_socket.send(str(game_id).encode())
-    data = client_socket.recv(1024).decode()
-    return json.loads(data)
+def request_game_info(client_socket, game_ids):
+    """Send one lookup for up to MAX_INFO_IDS game IDs without waiting for
+    the answer, returns the request ID to wait on."""
+    request_id = next(request_ids)
+    with pending_lock:
+        pending_requests[request_id] = [threading.Event(), None]
+    with send_lock:
+        client_socket.sendall(encode_info_request(request_id, game_ids))
+    return request_id
+
+
+def wait_game_info(request_id, timeout=5):
+    with pending_lock:
+        request = pending_requests.get(request_id)
+    answered = request is not None and request[0].wait(timeout)
+    with pending_lock:
+        pending_requests.pop(request_id, None)
+    if not answered:
+        raise TimeoutError(f"No response to game info request {request_id}")
+    if isinstance(request[1], Exception):
+        raise request[1]
+    return request[1]
+
+
+def query_game_info(client_socket, game_ids):
+    """Game info by game ID. Large lookups are split into several requests
+    which are all sent before waiting on any of them."""
+    game_ids = [int(game_id) for game_id in game_ids]
+    sent = [
+        request_game_info(client_socket, game_ids[i : i + MAX_INFO_IDS])
+        for i in range(0, len(game_ids), MAX_INFO_IDS)
+    ]
+    response = {}
+    for request_id in sent:
+        response.update(wait_game_info(request_id))
+    return response
 
 
-def send_to_server(coordinates, client_socket):
+def send_to_server(samples, client_socket):
     try:
-        # converting list to JSON string before sending
-        data = json.dumps(coordinates).encode("utf-8")
-        client_socket.sendall(data)
+        # Length-prefixed frames carrying the batch, one unless it is huge
+        with send_lock:
+            client_socket.sendall(encode_samples(samples))
     except Exception as e:
         print(f"Error sending data to server: {e}")
 
 
 def accelerometer_reader(stop_event, client_socket):
     """Thread function to read accelerometer data from FPGA via JTAG UART"""
+    # Only the board reader needs the JTAG driver, the rest of the client
+    # (and the benchmarks of data_extraction) work without it
+    import intel_jtag_uart
+
     # Try different cable names, including the one that worked for you
     cable_names = [
         "USB-Blaster [USB-0]",  # Try this first since it worked for you
@@ -61,6 +121,8 @@ def accelerometer_reader(stop_event, client_socket):
 
     ju = None
     connected = False
+    batch = []  # (x, y, player, room) samples waiting to be sent
+    last_flush = time.monotonic()
 
     while not stop_event.is_set():
         # If not connected, try to connect
@@ -87,16 +149,24 @@ def accelerometer_reader(stop_event, client_socket):
                 # Put data in queue and also print immediately
                 formatted_data = f"{data.strip()}"
 
-                # send to server
-                clean_coords = data_extraction(formatted_data)
-                clean_coords.append(1)
-                send_to_server(clean_coords, client_socket)
+                # queue the sample for the next batch sent to the server
+                x, y = data_extraction(formatted_data)
+                batch.append((x, y, 1, ROOM_ID))
 
                 # put data in queue
+                timestamp = time.strftime("%H:%M:%S")
                 accel_data_queue.put((timestamp, data.strip()))
 
+            now = time.monotonic()
+            if batch and (
+                now - last_flush >= BATCH_INTERVAL or len(batch) >= BATCH_SIZE
+            ):
+                send_to_server(batch, client_socket)
+                batch = []
+                last_flush = now
+
             # Small delay to avoid hammering the JTAG interface
-            time.sleep(0.1)
+            time.sleep(SAMPLE_INTERVAL)
 
         except Exception as e:
             print(f"Error reading from JTAG: {e}")
@@ -139,10 +209,12 @@ def start_client():
             choice = input("Enter your choice (1-3): ")
 
             if choice == "1":
-                game_id = input("Enter Game ID to query: ")
+                game_ids = input("Enter Game IDs to query (comma separated): ")
                 try:
-                    response = query_game_info(client_socket, game_id)
-                    print("Game Info:", response)
+                    game_ids = [g for g in re.split(r"[,\s]+", game_ids) if g]
+                    response = query_game_info(client_socket, game_ids)
+                    for game_id, info in response.items():
+                        print(f"Game {game_id}:", info)
                 except Exception as e:
                     print(f"Error querying game info: {e}")
 
@@ -167,7 +239,8 @@ def start_client():
 
             elif choice == "3":
                 print("Exiting...")
-                client_socket.send("exit".encode())
+                with send_lock:
+                    client_socket.send(encode_frame(FRAME_EXIT))
                 break
 
             else:
@@ -180,7 +253,8 @@ def start_client():
         stop_event.set()
         # Close socket
         try:
-            client_socket.send("exit".encode())
+            with send_lock:
+                client_socket.send(encode_frame(FRAME_EXIT))
         except:
             pass
         client_socket.close()
@@ -192,6 +266,7 @@ if __name__ == "__main__":
     # Server connection details
     HOST = "ec2-3-88-178-208.compute-1.amazonaws.com"
     PORT = 12000
+    ROOM_ID = int(os.environ.get("ROOM_ID", 0))  # Game session this board plays in
 
     # GAME MAPPINGS
     MIN_X_VAL = 0
@@ -199,7 +274,19 @@ if __name__ == "__main__":
     MIN_Y_VAL = 0
     MAX_Y_VAL = 7000
 
+    # Accelerometer sampling and batching towards the server
+    SAMPLE_INTERVAL = 0.02  # Seconds between JTAG reads (50 Hz)
+    BATCH_INTERVAL = 0.05  # Send whatever has been sampled at least this often
+    BATCH_SIZE = 16  # Samples per frame before sending early
+
     # Queue for sharing accelerometer data between threads
     accel_data_queue = queue.Queue()
+    # Game info requests waiting for their response, by request ID. Several can
+    # be in flight on the one connection, responses are matched by request ID.
+    pending_requests = {}  # request ID -> [threading.Event, response]
+    pending_lock = threading.Lock()
+    request_ids = itertools.count(1)
+    # The accelerometer thread and the menu both write frames to the socket
+    send_lock = threading.Lock()
 
     start_client()
@@ -3,6 +3,35 @@ import socket
 import threading
 import json
 import os
+import random
+
+from atlas import open_atlas
+from protocol import (
+    ACK,
+    CONTROL_MESSAGES,
+    FRAGMENT,
+    FLAG_ATTACK,
+    FLAG_GREEN,
+    GAME_OVER,
+    GAME_START,
+    HELLO,
+    HIGH_SCORES,
+    MAX_DATAGRAM,
+    PLAY_AGAIN,
+    PLAYER_ID,
+    SCORE,
+    SNAPSHOT,
+    SNAPSHOT_ACK,
+    WAITING,
+    ProtocolError,
+    Reassembler,
+    apply_snapshot,
+    decode,
+    decode_snapshot,
+    encode,
+)
+from render_cache import RotationCache, TextCache
+from reliable import ReliableChannel
 
 
 def load_animation_frames(folder, flip=False, scale_size=(128, 128)):
@@ -10,6 +39,11 @@ def load_animation_frames(folder, flip=False, scale_size=(128, 128)):
     if not os.path.exists(folder):
         return [pygame.Surface(scale_size, pygame.SRCALPHA)]  # Placeholder frame
 
+    # Prebuilt by atlas.py, already scaled and with nothing to decode
+    atlas_frames = sprite_atlas.frames(folder, scale_size) if sprite_atlas else None
+    if atlas_frames:
+        return flip_frames(atlas_frames) if flip else atlas_frames
+
     for filename in sorted(os.listdir(folder)):
         if filename.endswith(".png"):
             frame = pygame.image.load(os.path.join(folder, filename)).convert_alpha()
@@ -21,16 +55,36 @@ def load_animation_frames(folder, flip=False, scale_size=(128, 128)):
     return frames if frames else [pygame.Surface(scale_size, pygame.SRCALPHA)]
 
 
+def flip_frames(frames):
+    """Mirror image of every frame, player 2 faces the other way."""
+    return [pygame.transform.flip(frame, True, False) for frame in frames]
+
+
+def send_message(msg_type, *fields):
+    global send_seq, control_seq
+    server = (SERVER_IP, SERVER_PORT)
+    if msg_type in CONTROL_MESSAGES:
+        control_seq += 1
+        data = encode(msg_type, ROOM_ID, control_seq, *fields)
+        control.sent(server, control_seq, data)  # Resent until the server acks
+    else:
+        send_seq += 1
+        data = encode(msg_type, ROOM_ID, send_seq, *fields)
+    client_socket.sendto(data, server)
+
+
 def send_player_id(selected_id):
     global player_id
     player_id = selected_id
-    message = f"PLAYER_ID,{player_id}"
-    client_socket.sendto(message.encode(), (SERVER_IP, SERVER_PORT))
+    # The room we join numbers its control messages from its own start point
+    control.restart((SERVER_IP, SERVER_PORT))
+    send_message(PLAYER_ID, player_id)
 
 
-def draw_text(text, x, y, color=(255, 255, 255)):
-    text_surface = font.render(text, True, color)
-    screen.blit(text_surface, (x - text_surface.get_width() // 2, y))
+def draw_text(text, x, y, color=(255, 255, 255), target=None):
+    text_surface = texts.render(font, text, color)
+    target = screen if target is None else target
+    target.blit(text_surface, (x - text_surface.get_width() // 2, y))
 
 
 def draw_menu():
@@ -41,131 +95,186 @@ def draw_menu():
 
 
 def draw_high_scores():
-    screen.fill((0, 0, 0))
-    draw_text("High Scores", WIDTH // 2, 100)
+    global high_scores_surface, high_scores_dirty
+    if high_scores_dirty or high_scores_surface is None:
+        # Composed once per HIGH_SCORES message, blitted every frame after
+        high_scores_dirty = False
+        high_scores_surface = compose_high_scores()
+    screen.blit(high_scores_surface, (0, 0))
+    pygame.display.flip()
+
+
+def compose_high_scores():
+    surface = pygame.Surface((WIDTH, HEIGHT))
+    surface.fill((0, 0, 0))
+    draw_text("High Scores", WIDTH // 2, 100, target=surface)
     y_offset = 150
     for score_entry in high_scores:
         color = (255, 255, 0) if score_entry == latest_game else (200, 200, 200)
         score_text = f"{score_entry['timestamp']}: P1-{score_entry['player_1_score']} P2-{score_entry['player_2_score']}"
         if "rank" in score_entry:
             score_text += f" (Rank: {score_entry['rank']})"
-        draw_text(score_text, WIDTH // 2, y_offset, color)
+        draw_text(score_text, WIDTH // 2, y_offset, color, surface)
         y_offset += 40
-    draw_text("Press ENTER to play again", WIDTH // 2, y_offset + 40, (200, 200, 200))
-    pygame.display.flip()
+    draw_text(
+        "Press ENTER to play again", WIDTH // 2, y_offset + 40, (200, 200, 200), surface
+    )
+    return surface
 
 
 def request_play_again():
     global player_id, waiting_for_other
     if player_id is not None:
-        client_socket.sendto(
-            f"PLAY_AGAIN,{player_id}".encode(), (SERVER_IP, SERVER_PORT)
-        )
+        send_message(PLAY_AGAIN, player_id)
         waiting_for_other = False  # Ensure it resets after sending request
 
 
+def on_game_start():
+    global game_state, waiting_for_other, boss_hp, game_over_sent, snapshot_flags
+    global latest_snapshot_seq
+    print("Received GAME_START from server. Resetting game state.")
+    game_state = "playing"
+    waiting_for_other = False
+    boss_hp = 3000
+    scores[1] = 0
+    scores[2] = 0
+    player_health.update({1: 100, 2: 100})  # Reset player HP
+    enemy_attack.update({1: False, 2: False})  # Reset enemy attack flags
+    enemy_attack_timer.update({1: 0, 2: 0})  # Reset timers
+    game_over_sent = False
+    snapshot_flags = 0
+    latest_snapshot_seq = 0  # A new room numbers its snapshots from anywhere
+    pygame.event.post(pygame.event.Event(pygame.USEREVENT, {"type": "game_reset"}))
+
+
+def on_high_scores(scores_json):
+    global game_state, high_scores, latest_game, high_scores_dirty
+    print("Received High Scores JSON:", scores_json[:100])
+    high_scores = json.loads(scores_json.decode())
+    latest_game = high_scores[-1] if "rank" in high_scores[-1] else None
+    high_scores_dirty = True
+    if boss_hp <= 0:
+        game_state = "high_scores"
+
+
+def on_waiting(other_player):
+    global waiting_for_other
+    print(f"Player {player_id} is waiting...")
+    if game_state != "playing":  # Only wait if the game hasn't started
+        waiting_for_other = True
+
+
+def on_score(p_id, attacking):
+    """A player landed a hit: swing their sword and animate the boss."""
+    sword_states[p_id] = "combo"
+    sword_frame_index[p_id] = 0
+    if attacking:
+        enemy_attack[p_id] = True
+        enemy_attack_timer[p_id] = pygame.time.get_ticks()
+        if current_animation != "cleave":
+            update_boss_animation("cleave")
+    elif boss_hp <= 0:
+        update_boss_animation("die")
+    else:
+        if current_animation != "take_hit":
+            update_boss_animation("hit")
+
+
+def on_snapshot_delta(seq, payload):
+    global latest_snapshot_seq
+    baseline_seq, mask, values = decode_snapshot(payload)
+    if not baseline_seq and snapshot_history and seq < min(snapshot_history):
+        # A keyframe older than all we kept: the room was recreated
+        snapshot_history.clear()
+        latest_snapshot_seq = 0
+    baseline = snapshot_history.get(baseline_seq) if baseline_seq else None
+    if baseline_seq and baseline is None:
+        return  # Baseline already forgotten, the next keyframe will resync us
+    state = apply_snapshot(baseline, mask, values)
+    snapshot_history[seq] = state
+    if len(snapshot_history) > SNAPSHOT_HISTORY:
+        del snapshot_history[min(snapshot_history)]
+    send_message(SNAPSHOT_ACK, seq)
+    if seq > latest_snapshot_seq:  # Ignore snapshots that arrive out of order
+        latest_snapshot_seq = seq
+        on_snapshot(*state)
+
+
+def on_snapshot(boss_health, angle, score_1, score_2, angle_1, angle_2, flags):
+    global boss_hp, overlay_angle, snapshot_flags
+    boss_hp = max(boss_health, 0)  # Sync boss HP from server
+    new_attacks = flags & ~snapshot_flags
+    snapshot_flags = flags
+    for p_id, score in ((1, score_1), (2, score_2)):
+        if score != scores[p_id]:
+            scores[p_id] = score
+            if score != 0:
+                on_score(p_id, new_attacks & FLAG_ATTACK[p_id])
+
+    if game_state == "playing":
+        overlay_angle = angle
+        for p_id, tenths in ((1, angle_1), (2, angle_2)):
+            players[p_id]["angle"] = tenths / 10
+            green = flags & FLAG_GREEN[p_id]
+            players[p_id]["color"] = (0, 255, 0) if green else (255, 0, 0)
+
+
+# Message type -> handler called with the decoded payload fields
+MESSAGE_HANDLERS = {
+    GAME_START: on_game_start,
+    HIGH_SCORES: on_high_scores,
+    WAITING: on_waiting,
+}
+
+
+def handle_datagram(data):
+    msg_type, _, seq, fields = decode(data)
+    if msg_type == FRAGMENT:
+        data = reassembler.feed((SERVER_IP, SERVER_PORT), data)
+        if data is None:
+            return  # Wait for the rest of the pieces
+        msg_type, _, seq, fields = decode(data)
+    if msg_type == SNAPSHOT:
+        on_snapshot_delta(seq, *fields)
+        return
+    if msg_type == ACK:
+        control.acknowledge((SERVER_IP, SERVER_PORT), *fields)
+        return
+    if msg_type in CONTROL_MESSAGES:
+        new, newest, bits = control.receive((SERVER_IP, SERVER_PORT), seq)
+        send_message(ACK, newest, bits)
+        if not new:
+            return  # A retransmission of one already handled
+    handler = MESSAGE_HANDLERS.get(msg_type)
+    if handler is not None:
+        handler(*fields)
+
+
 def receive_data():
-    global game_state, high_scores, latest_game, waiting_for_other, boss_hp
     while True:
         try:
             data, _ = client_socket.recvfrom(BUFFER_SIZE)
-            decoded_data = data.decode()
-
-            if decoded_data.startswith("GAME_START"):
-                print("Received GAME_START from server. Resetting game state.")
-                game_state = "playing"
-                waiting_for_other = False
-                boss_hp = 3000
-                scores[1] = 0
-                scores[2] = 0
-                player_health = {1: 100, 2: 100}  # Reset player HP
-                enemy_attack = {1: False, 2: False}  # Reset enemy attack flags
-                enemy_attack_timer = {1: 0, 2: 0}  # Reset timers
-                game_over_sent = False
-                pygame.event.post(
-                    pygame.event.Event(pygame.USEREVENT, {"type": "game_reset"})
-                )
-
-            elif decoded_data.startswith("HIGH_SCORES"):
-                _, scores_json = decoded_data.split(",", 1)
-                print("Received High Scores JSON:", scores_json[:100])
-                high_scores = json.loads(scores_json)
-                latest_game = high_scores[-1] if "rank" in high_scores[-1] else None
-                if boss_hp <= 0:
-                    game_state = "high_scores"
-            elif decoded_data.startswith("WAITING"):
-                print(f"Player {player_id} is waiting...")
-                _, other_player = decoded_data.split(",")
-                if game_state != "playing":  # Only wait if the game hasn't started
-                    waiting_for_other = True
-
-            elif decoded_data.startswith("SCORE_UPDATE"):
-                _, p_id, score, boss_health = decoded_data.split(",")
-                p_id = int(p_id)
-                scores[p_id] = int(score)
-                boss_hp = int(boss_health)  # Sync boss HP from server
-                sword_states[p_id] = "combo"
-                sword_frame_index[p_id] = 0
-                if scores[p_id] % 6 == 0 and scores[p_id] != 0:
-                    enemy_attack[p_id] = True
-                    enemy_attack_timer[p_id] = pygame.time.get_ticks()
-                    if current_animation != "cleave":
-                        update_boss_animation("cleave")
-                elif boss_hp <= 0:
-                    boss_hp = 0
-                    update_boss_animation("die")
-                else:
-                    if current_animation != "take_hit":
-                        update_boss_animation("hit")
-
-            if game_state == "playing":
-                if decoded_data.startswith("OVERLAY"):
-                    _, angle = decoded_data.split(",")
-                    global overlay_angle
-                    overlay_angle = int(angle)
-                elif decoded_data.startswith("SCORE_UPDATE"):
-                    _, player_id, score, boss_health = decoded_data.split(",")
-                    scores[int(player_id)] = int(score)
-                    boss_hp = int(boss_health)  # Sync boss HP from server
-                    sword_states[int(player_id)] = "combo"
-                    sword_frame_index[int(player_id)] = 0
-                    if boss_hp <= 0:
-                        boss_hp = 0
-                        update_boss_animation("die")
-                    else:
-                        update_boss_animation("hit")
-                else:
-                    xpos, ypos, player_id = map(float, decoded_data.split(","))
-                    angle = (
-                        (xpos - X_MID) / (X_MAX - X_MIN)
-                    ) * 90  # Scale to -45 to 45
-                    color = (0, 255, 0) if ypos > Y_MID else (255, 0, 0)
-                    players[int(player_id)]["angle"] = angle
-                    players[int(player_id)]["color"] = color
-        except ValueError:
-            pass
+            handle_datagram(data)
+        except (ProtocolError, ValueError) as e:
+            print(f"Dropped bad datagram: {e}")
         except socket.timeout:
             continue
 
 
 def send_score(player_id):
-    message = f"SCORE,{player_id}"
-    client_socket.sendto(message.encode(), (SERVER_IP, SERVER_PORT))
+    send_message(SCORE, player_id)
 
 
 def draw_tilting_rectangle(pivot, angle, color):
     """Draws a rectangle tilted around a pivot point."""
-    rect_surf = pygame.Surface((RECT_WIDTH, RECT_HEIGHT), pygame.SRCALPHA)
-    rect_surf.fill(color)
-    rotated_surf = pygame.transform.rotate(rect_surf, angle)
+    rotated_surf = rotations.get((RECT_WIDTH, RECT_HEIGHT), color, angle)
     rotated_rect = rotated_surf.get_rect(center=pivot)
     screen.blit(rotated_surf, rotated_rect.topleft)
 
 
 def draw_overlay_rectangle(pivot, angle, color=(255, 255, 255, 50)):
-    overlay_surf = pygame.Surface((RECT_WIDTH + 10, RECT_HEIGHT + 10), pygame.SRCALPHA)
-    overlay_surf.fill(color)
-    rotated_surf = pygame.transform.rotate(overlay_surf, angle)
+    size = (RECT_WIDTH + 10, RECT_HEIGHT + 10)
+    rotated_surf = rotations.get(size, color, angle)
     rotated_rect = rotated_surf.get_rect(center=pivot)
     screen.blit(rotated_surf, rotated_rect.topleft)
 
@@ -278,31 +387,38 @@ if __name__ == "__main__":
     screen = pygame.display.set_mode((WIDTH, HEIGHT))
     clock = pygame.time.Clock()
     font = pygame.font.Font(None, 36)
+    texts = TextCache()  # Rendered strings, the HUD and menus rarely change
 
     game_state = "menu"
     player_id = None
     high_scores = []
     latest_game = None
+    high_scores_surface = None  # The whole high score screen, once composed
+    high_scores_dirty = False  # New scores arrived, compose it again
     waiting_for_other = False
 
     # Network setup
     SERVER_IP = "ec2-3-88-178-208.compute-1.amazonaws.com"
     SERVER_PORT = 12345
-    BUFFER_SIZE = 1024
+    BUFFER_SIZE = MAX_DATAGRAM  # Longer messages arrive as FRAGMENTs
+    reassembler = Reassembler()
+    ROOM_ID = int(os.environ.get("ROOM_ID", 0))  # Game session to join on the server
 
     client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     client_socket.settimeout(0.1)
-    client_socket.sendto(b"HELLO", (SERVER_IP, SERVER_PORT))
-
-    # Define pivot points and rotation range
-    X_MIN, X_MAX = 0, 7000  # X range
-    Y_MIN, Y_MAX = 0, 7000  # Y range
-    X_MID = (X_MIN + X_MAX) / 2
-    Y_MID = (Y_MIN + Y_MAX) / 2
-
+    send_seq = 0  # Sequence number of the last datagram sent to the server
+    # GAME_OVER is acked by the server, GAME_START, WAITING and HIGH_SCORES by us
+    control = ReliableChannel()
+    control_seq = random.getrandbits(31)  # Last control message sent
+    send_message(HELLO)
+    KEEPALIVE_INTERVAL = 30000  # ms, the server drops clients silent for longer
+    last_keepalive = pygame.time.get_ticks()
+
+    # Define pivot points
     PIVOT_1 = (WIDTH // 4, HEIGHT // 2)  # Player 1 pivot (Left side)
     PIVOT_2 = (3 * WIDTH // 4, HEIGHT // 2)  # Player 2 pivot (Right side)
     RECT_WIDTH, RECT_HEIGHT = 120, 20  # Rectangle dimensions
+    rotations = RotationCache()  # Rotated rectangles, rotating is the costly part
 
     players = {
         1: {"angle": 0, "color": (255, 0, 0)},
@@ -310,6 +426,10 @@ if __name__ == "__main__":
     }
     scores = {1: 0, 2: 0}
     overlay_angle = 0  # Updated from the server
+    snapshot_flags = 0  # Flags byte of the last SNAPSHOT
+    snapshot_history = {}  # Sequence number -> snapshot state, delta baselines
+    latest_snapshot_seq = 0
+    SNAPSHOT_HISTORY = 32
     boss_hp = 3000
     boss_hp_max = 3000
     boss_hp_bar_length = 400
@@ -334,24 +454,19 @@ if __name__ == "__main__":
         "die": "individual_sprites/05_demon_death",
     }
 
-    # Load animations for swords
+    # Sprites come from the atlas built by atlas.py when there is one
+    sprite_atlas = open_atlas(os.environ.get("SPRITE_ATLAS", "sprites.atlas"))
+
+    # Load animations for swords, player 2's are flipped in memory
     SWORD_PATH = "sword_sprites"
-    sword_idle = {
-        1: load_animation_frames(
-            os.path.join(SWORD_PATH, "sword_idle"), scale_size=(300, 300)
-        ),
-        2: load_animation_frames(
-            os.path.join(SWORD_PATH, "sword_idle"), flip=True, scale_size=(300, 300)
-        ),
-    }
-    sword_combo = {
-        1: load_animation_frames(
-            os.path.join(SWORD_PATH, "sword_combo"), scale_size=(300, 300)
-        ),
-        2: load_animation_frames(
-            os.path.join(SWORD_PATH, "sword_combo"), flip=True, scale_size=(300, 300)
-        ),
-    }
+    frames = load_animation_frames(
+        os.path.join(SWORD_PATH, "sword_idle"), scale_size=(300, 300)
+    )
+    sword_idle = {1: frames, 2: flip_frames(frames)}
+    frames = load_animation_frames(
+        os.path.join(SWORD_PATH, "sword_combo"), scale_size=(300, 300)
+    )
+    sword_combo = {1: frames, 2: flip_frames(frames)}
 
     sword_states = {1: "idle", 2: "idle"}
     sword_frame_index = {1: 0, 2: 0}
@@ -403,9 +518,9 @@ if __name__ == "__main__":
                     send_score(p_id)
 
             # Display scores
-            score_text_1 = font.render(f"Player 1: {scores[1]}", True, (255, 255, 255))
+            score_text_1 = texts.render(font, f"Player 1: {scores[1]}", (255, 255, 255))
             screen.blit(score_text_1, (20, 20))
-            score_text_2 = font.render(f"Player 2: {scores[2]}", True, (255, 255, 255))
+            score_text_2 = texts.render(font, f"Player 2: {scores[2]}", (255, 255, 255))
             screen.blit(score_text_2, (WIDTH - 150, 20))
 
             # For each player, draw only if health > 0
@@ -456,29 +571,17 @@ if __name__ == "__main__":
                         if player_health[1] <= 0 and player_health[2] <= 0:
                             # Send GAME_OVER for each player and transition to high scores
                             if player_health[1] <= 0:
-                                client_socket.sendto(
-                                    f"GAME_OVER,1,{player_health[1]}".encode(),
-                                    (SERVER_IP, SERVER_PORT),
-                                )
+                                send_message(GAME_OVER, 1, player_health[1])
                             if player_health[2] <= 0:
-                                client_socket.sendto(
-                                    f"GAME_OVER,2,{player_health[2]}".encode(),
-                                    (SERVER_IP, SERVER_PORT),
-                                )
+                                send_message(GAME_OVER, 2, player_health[2])
                             game_over_sent = True
                             game_state = "high_scores"
 
                         # Send GAME_OVER for each player that is now out.
                         if player_health[1] <= 0:
-                            client_socket.sendto(
-                                f"GAME_OVER,1,{player_health[1]}".encode(),
-                                (SERVER_IP, SERVER_PORT),
-                            )
+                            send_message(GAME_OVER, 1, player_health[1])
                         if player_health[2] <= 0:
-                            client_socket.sendto(
-                                f"GAME_OVER,2,{player_health[2]}".encode(),
-                                (SERVER_IP, SERVER_PORT),
-                            )
+                            send_message(GAME_OVER, 2, player_health[2])
                         game_over_sent = True
                         game_state = "high_scores"  # Transition locally to high scores
 
@@ -497,6 +600,13 @@ if __name__ == "__main__":
                     waiting_for_other = True
                     game_state = "waiting"
 
+        # Keep our place in the room while sitting on a menu or the high scores
+        if pygame.time.get_ticks() - last_keepalive > KEEPALIVE_INTERVAL:
+            send_message(HELLO)
+            last_keepalive = pygame.time.get_ticks()
+        for data, addr in control.due():
+            client_socket.sendto(data, addr)
+
         pygame.display.flip()
         clock.tick(60)
     pygame.quit()
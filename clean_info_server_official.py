@@ -1,304 +1,562 @@
-import socket
-import threading
+import asyncio
+import logging
+import os
 import random
-import time
-import boto3
+import signal
+import socket
 import datetime
 import json
-from decimal import Decimal
-
-
-def create_table():
-    existing_tables = [table.name for table in dynamodb.tables.all()]
-    if table_name not in existing_tables:
-        table = dynamodb.create_table(
-            TableName=table_name,
-            KeySchema=[{"AttributeName": "game_id", "KeyType": "HASH"}],
-            AttributeDefinitions=[{"AttributeName": "game_id", "AttributeType": "N"}],
-            ProvisionedThroughput={"ReadCapacityUnits": 10, "WriteCapacityUnits": 10},
-        )
-        table.wait_until_exists()
-        print("GameScores table created successfully!")
 
-
-def save_game_result():
-    table = dynamodb.Table(table_name)
-    game_id = int(time.time())  # Unique game ID based on timestamp
+from fanout import FanOut
+from leaderboard import Leaderboard, QueryLeaderboard
+from logs import every, setup_logging
+from metrics import port_from_env, registry
+from persistence import GameIdGenerator, WriteBehindQueue
+from protocol import (
+    ACK,
+    CONTROL_MESSAGES,
+    GAME_OVER,
+    GAME_START,
+    HELLO,
+    HIGH_SCORES,
+    MESSAGE_NAMES,
+    PLAY_AGAIN,
+    PLAYER_ID,
+    POSITION,
+    SCORE,
+    SNAPSHOT_ACK,
+    WAITING,
+    FRAME_EXIT,
+    FRAME_SAMPLES,
+    FrameReader,
+    decode,
+    encode,
+    encode_into,
+    encode_snapshot_into,
+    SAMPLE,
+    iter_samples,
+    peek_name,
+    peek_room,
+    snapshot_mask,
+)
+from recording import INBOUND, TCP, UDP, Recorder
+from reliable import ReliableChannel
+from rooms import UNACKED_DELTA_LIMIT, RoomRegistry
+from sharding import (
+    FORWARD_CLIENT_DATAGRAM,
+    FORWARD_FPGA_SAMPLE,
+    FORWARD_GAME_RESULT,
+    forward_address,
+    pack_forward,
+    run_workers,
+    unpack_forward,
+    worker_for_room,
+)
+from storage import open_storage
+
+log = logging.getLogger(__name__)
+
+
+def save_game_result(room):
+    game_id = game_ids.next_id()  # Provisional ID, valid before the write lands
     timestamp = datetime.datetime.now().isoformat()
     item = {
         "game_id": game_id,
-        "player_1_score": scores[1],
-        "player_2_score": scores[2],
+        "room_id": room.room_id,
+        "player_1_score": room.scores[1],
+        "player_2_score": room.scores[2],
         "timestamp": timestamp,
     }
-    table.put_item(Item=item)
-    print("Game results saved to database.")
+    leaderboard.add(item)
+    share_game_result(item)
+    results_queue.submit(item)  # Stored in the background, never blocks the loop
     return game_id  # Return the game ID of the latest game
 
 
-def convert_decimal(obj):
-    if isinstance(obj, Decimal):
-        return int(obj)
-    elif isinstance(obj, dict):
-        return {k: convert_decimal(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_decimal(i) for i in obj]
-    return obj
+def load_leaderboard():
+    """Read every past game once at startup."""
+    with registry.timer("storage.load_game_results"):
+        leaderboard.load(storage.load_game_results())
+    log.info("Loaded %d past games into the leaderboard.", len(leaderboard.games))
+
+
+def share_game_result(item):
+    """Tell the other workers about a finished game so their leaderboards match."""
+    if num_workers == 1:
+        return
+    data = pack_forward(FORWARD_GAME_RESULT, ("0.0.0.0", 0), json.dumps(item).encode())
+    for worker in range(num_workers):
+        if worker != worker_index:
+            forward_transport.sendto(data, forward_address(worker))
 
 
 def get_high_scores(latest_game_id):
-    table = dynamodb.Table(table_name)
-    response = table.scan()
-    scores_list = response.get("Items", [])
-    scores_list = convert_decimal(scores_list)
-    sorted_scores = sorted(
-        scores_list,
-        key=lambda x: max(x["player_1_score"], x["player_2_score"]),
-        reverse=True,
-    )
+    # Top 5 scores, plus the latest game's ranking if it is not in the top 5
+    with registry.timer("leaderboard.high_scores"):
+        return leaderboard.high_scores(latest_game_id)
 
-    # Get top 5 scores
-    top_5_scores = sorted_scores[:5]
-
-    # Find the latest game's ranking if it is not in the top 5
-    latest_game_rank = next(
-        (
-            i + 1
-            for i, game in enumerate(sorted_scores)
-            if game["game_id"] == latest_game_id
-        ),
-        None,
-    )
-    latest_game_score = next(
-        (game for game in sorted_scores if game["game_id"] == latest_game_id), None
-    )
 
-    if latest_game_rank and latest_game_rank > 5:
-        latest_game_score["rank"] = latest_game_rank
-        return top_5_scores + [latest_game_score]
-    else:
-        return top_5_scores
+def send_to_room(room, msg_type, *fields):
+    log.debug("Sending %s to room %d", MESSAGE_NAMES[msg_type], room.room_id)
 
+    seq = room.next_seq()
+    length = encode_into(fanout.buffer, msg_type, room.room_id, seq, *fields)
+    sent = fanout.send(length, room.addresses)
+    registry.count("out", MESSAGE_NAMES[msg_type], length * sent, sent)
+    if msg_type in CONTROL_MESSAGES:
+        data = bytes(fanout.view[:length])
+        for addr in room.addresses:
+            control.sent(addr, seq, data)
 
-def send_to_all_clients(message):
-    print(f"Sending to clients: {message[:100]}...")  # Debug print
 
-    for addr in clients.keys():  # Use stored (IP, Port) tuples
-        if isinstance(addr, tuple):  # Ensure it's a valid address tuple
-            server_socket.sendto(message.encode(), addr)
-        else:
-            print(f"Error: Invalid address {addr} in clients dictionary")
+def send_ack(addr, room_id, newest, bits):
+    data = encode(ACK, room_id, 0, newest, bits)
+    fanout.send_data(data, (addr,))
+    registry.count("out", "ACK", len(data))
 
 
-def UDP_handle_client():
-    global boss_hp, game_running, players_ready
-    while True:
-        try:
-            data, addr = server_socket.recvfrom(UDP_BUFFER_SIZE)
-            message = data.decode()
+def resend_control():
+    """Send control messages again that went unacknowledged for too long."""
+    for data, addr in control.due():
+        fanout.send_data(data, (addr,))
+        registry.count("retransmit", peek_name(data), len(data))
 
-            if message.startswith("PLAYER_ID"):
-                _, player_id = message.split(",")
-                player_id = int(player_id)
 
-                clients[addr] = player_id  # Store player's network address as key
-                players_ready.add(player_id)
+class GameServerProtocol(asyncio.DatagramProtocol):
+    """UDP game port. Every datagram is handled on the event loop thread."""
 
-                print(
-                    f"Player {player_id} joined from {addr}. Clients mapping: {clients}"
+    def datagram_received(self, data, addr):
+        if recorder is not None:
+            recorder.record(INBOUND, UDP, addr, data)
+        msg_name = peek_name(data)
+        registry.count("in", msg_name, len(data))
+        try:
+            owner = worker_for_room(peek_room(data), num_workers)
+            if owner != worker_index:
+                forward_transport.sendto(
+                    pack_forward(FORWARD_CLIENT_DATAGRAM, addr, data),
+                    forward_address(owner),
                 )
+                return
+            with registry.timer(msg_name):
+                handle_udp_message(data, addr)
+        except Exception as e:
+            log.warning("Bad datagram from %s: %s", addr, e, extra=every(100))
+
+    def error_received(self, exc):
+        log.warning("UDP error: %s", exc, extra=every(100))
 
-                if len(players_ready) == 2:
-                    game_running = True
-                    print("Game started!")
-                    send_to_all_clients("GAME_START")
-
-            elif message.startswith("GAME_OVER"):
-                # Message format: GAME_OVER,player_id,remaining_health
-                try:
-                    _, pid, remaining_health = message.split(",")
-                    pid = int(pid)
-                    remaining_health = int(remaining_health)
-                    final_health[pid] = remaining_health
-                    # End the game when any player sends a GAME_OVER
-                    game_running = False
-                    # Compute final scores: final score = attack score + remaining health
-                    final_score1 = scores[1] + final_health.get(1, 0)
-                    final_score2 = scores[2] + final_health.get(2, 0)
-                    scores[1] = final_score1
-                    scores[2] = final_score2
-                    latest_game_id = save_game_result()
-                    high_scores = get_high_scores(latest_game_id)
-                    send_to_all_clients(f"HIGH_SCORES,{json.dumps(high_scores)}")
-                    players_ready.clear()
-                except Exception as e:
-                    print("Error processing GAME_OVER message:", e)
-
-            elif game_running and message.startswith("SCORE"):
-                _, player_id = message.split(",")
-                player_id = int(player_id)
-                scores[player_id] += 1
-
-                if boss_hp > 0:
-                    boss_hp -= 10
-                    send_to_all_clients(
-                        f"SCORE_UPDATE,{player_id},{scores[player_id]},{boss_hp}"
-                    )
-                    print(f"Player {player_id} scored! Boss HP: {boss_hp}")
-
-                if boss_hp <= 0:
-                    boss_hp = 0
-                    print("Boss defeated! Saving scores and showing high scores.")
-                    game_running = False
-                    latest_game_id = save_game_result()
-                    high_scores = get_high_scores(latest_game_id)
-                    send_to_all_clients(f"HIGH_SCORES,{json.dumps(high_scores)}")
-                    players_ready.clear()
-
-            elif message.startswith("PLAY_AGAIN"):
-                _, player_id = message.split(",")
-                player_id = int(player_id)
-
-                # Find the actual player ID based on the sender's address
-                actual_player_id = clients.get(addr, None)
-
-                if actual_player_id is None:
-                    print(f"Unknown address {addr} tried to play again.")
-                    continue
-
-                print(f"Player {actual_player_id} wants to play again from {addr}")
-
-                players_ready.add(actual_player_id)
-
-                if len(players_ready) == 1:
-                    send_to_all_clients(f"WAITING,{actual_player_id}")
-                elif len(players_ready) == 2:
-                    send_to_all_clients("GAME_START")
-                    boss_hp = 3000
-                    scores[1] = scores[2] = 0
-                    game_running = True
-                    players_ready.clear()
 
+class ForwardProtocol(asyncio.DatagramProtocol):
+    """Loopback port where other workers hand over traffic for rooms we own."""
+
+    def datagram_received(self, data, _):
+        try:
+            kind, addr, payload = unpack_forward(data)
+            if kind == FORWARD_CLIENT_DATAGRAM:
+                with registry.timer(peek_name(payload)):
+                    handle_udp_message(payload, addr)
+            elif kind == FORWARD_FPGA_SAMPLE:
+                _, room_id, _, (x, y, player_no) = decode(payload)
+                send_fpga_data(room_id, x, y, player_no)
+            elif kind == FORWARD_GAME_RESULT:
+                leaderboard.add(json.loads(payload))
         except Exception as e:
-            print(f"Error: {e}")
-            continue
+            log.warning("Error handling forwarded datagram: %s", e, extra=every(100))
 
 
-def handle_tcp_client(conn, addr):
-    print(f"Client {addr} connected.")
-    TCP_clients.append(conn)
+def flush_snapshot(room, keyframe=False):
+    """Bring every member up to date with a delta against the newest snapshot
+    it acknowledged, or the full state on a keyframe."""
+    state = room.record_snapshot()
+    if state is None:
+        return  # Nothing has happened in the room yet
+    if keyframe:
+        groups = {0: room.addresses}
+    else:
+        groups = {}  # Baseline -> members getting the delta against it
+        for addr in room.addresses:
+            baseline_seq = room.baseline_for(addr)[0]
+            if baseline_seq == room.snapshot_seq:
+                continue  # Client already has this state
+            unacked = room.unacked.get(addr, 0)
+            if unacked >= UNACKED_DELTA_LIMIT:
+                continue  # Not acking, keyframes only until it does
+            room.unacked[addr] = unacked + 1
+            groups.setdefault(baseline_seq, []).append(addr)
+    # Members that acked the same snapshot share one encoded delta
+    for baseline_seq, addrs in groups.items():
+        baseline = room.history.get(baseline_seq) if baseline_seq else None
+        mask = snapshot_mask(baseline, state)
+        length = encode_snapshot_into(
+            fanout.buffer, room.room_id, room.snapshot_seq, baseline_seq, mask, state
+        )
+        sent = fanout.send(length, addrs)
+        registry.count("out", "SNAPSHOT", length * sent, sent)
+
+
+def send_high_scores(room, high_scores):
+    send_to_room(room, HIGH_SCORES, json.dumps(high_scores).encode())
 
-    try:
-        with conn:
-            print(f"Connected by {addr}")
-
-            # receiving data from clients
-            while True:
-                data = conn.recv(1024).decode("utf-8")
-                print(f"Receiving")
-                # the data is currently in JSON string, convert it back to a list (same format shown as client)
-                coordinates = json.loads(data)
-                send_fpga_data(coordinates[0], coordinates[1], coordinates[2])
-                print(coordinates)
-                if not data:
-                    break
-
-                # print(f"Data is coming through: {data}")
-                # try:
-                #     game_id = int(data)
-                #     response = fetch_game_info(data)
-                #     conn.send(response.encode())
-
-                # except ValueError:
-                #     #Its FPGA Data
-                #     print(f"FPGA Data from {addr}: {data}")
-
-                if data.lower() == "exit":
-                    print(f"Client {addr} requested exit.")
-                    break
 
+def send_queried_high_scores(room, done):
+    try:
+        high_scores = done.result()
     except Exception as e:
-        print(f"Error handling client {addr}: {e}")
+        # Clients wait on the high score screen, never leave them without one
+        log.error("High score query failed (%s), sending recent games only", e)
+        high_scores = leaderboard.recent_high_scores()
+    send_high_scores(room, high_scores)
+
+
+def end_game(room):
+    room.game_running = False
+    flush_snapshot(room)  # Clients should see the final HP before the leaderboard
+    latest_game_id = save_game_result(room)
+    room.players_ready.clear()
+    if leaderboard.blocking:
+        # Storage queries must not stall the loop, send the result when it is ready
+        future = asyncio.get_running_loop().run_in_executor(
+            None, get_high_scores, latest_game_id
+        )
+        future.add_done_callback(lambda done: send_queried_high_scores(room, done))
+    else:
+        send_high_scores(room, get_high_scores(latest_game_id))
 
-    finally:
-        print(f"Client {addr} disconnected.")
-        clients.remove(conn)
-        conn.close()
 
+def handle_player_id(room_id, addr, player_id):
+    room = rooms.join(addr, room_id, player_id)
+
+    log.info("Player %d joined room %d from %s", player_id, room_id, addr)
+
+    if len(room.players_ready) == 2:
+        room.game_running = True
+        log.info("Game started in room %d!", room_id)
+        send_to_room(room, GAME_START)
+
+
+def handle_game_over(room, addr, pid, remaining_health):
+    room.final_health[pid] = remaining_health
+    if not room.game_running:
+        return  # Both clients report GAME_OVER, only the first ends the round
+    # End the game when any player sends a GAME_OVER
+    # Compute final scores: final score = attack score + remaining health
+    room.scores[1] += room.final_health.get(1, 0)
+    room.scores[2] += room.final_health.get(2, 0)
+    end_game(room)
+
+
+def handle_score(room, addr, player_id):
+    if not room.game_running:
+        return
+    room.scores[player_id] += 1
+    # The boss swings back at every sixth hit
+    room.set_attack(player_id, room.scores[player_id] % 6 == 0)
+    room.dirty = True
+
+    if room.boss_hp > 0:
+        room.boss_hp -= 10
+        log.debug(
+            "Player %d scored! Boss HP: %d", player_id, room.boss_hp, extra=every(10)
+        )
+
+    if room.boss_hp <= 0:
+        room.boss_hp = 0
+        log.info("Boss defeated in room %d, saving scores.", room.room_id)
+        end_game(room)
+
+
+def handle_snapshot_ack(room, addr, seq):
+    room.acknowledge(addr, seq)
+
+
+def handle_play_again(room, addr, _):
+    # Find the actual player ID based on the sender's address
+    actual_player_id = room.members[addr]
+
+    log.info("Player %d wants to play again from %s", actual_player_id, addr)
+
+    room.players_ready.add(actual_player_id)
+
+    if len(room.players_ready) == 1:
+        send_to_room(room, WAITING, actual_player_id)
+    elif len(room.players_ready) == 2:
+        send_to_room(room, GAME_START)
+        room.reset()
+
+
+# Handlers for messages sent by clients that already joined a room
+ROOM_HANDLERS = {
+    GAME_OVER: handle_game_over,
+    SCORE: handle_score,
+    PLAY_AGAIN: handle_play_again,
+    SNAPSHOT_ACK: handle_snapshot_ack,
+}
+
+
+def handle_udp_message(data, addr):
+    msg_type, room_id, seq, fields = decode(data)
+
+    if msg_type == PLAYER_ID:
+        handle_player_id(room_id, addr, *fields)
+        return
+
+    room = rooms.room_of(addr)
+    if room is not None:
+        room.touch(addr)
+    if msg_type == HELLO:
+        return  # Also sent as a keepalive while a client sits on a menu
+    if msg_type == ACK:
+        control.acknowledge(addr, *fields)
+        return
+    if msg_type in CONTROL_MESSAGES:
+        new, newest, bits = control.receive(addr, seq)
+        send_ack(addr, room_id, newest, bits)  # Again if ours got lost
+        if not new:
+            return  # A retransmission of one already handled
+    if room is None:
+        log.warning(
+            "Unknown address %s sent %s before joining",
+            addr,
+            MESSAGE_NAMES[msg_type],
+            extra=every(100),
+        )
+        return
 
-def start_tcp_server():
-    """Start the TCP server for web/client connections."""
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as tcp_server_socket:
-        tcp_server_socket.bind((TCP_HOST, TCP_PORT))
-        tcp_server_socket.listen(5)
-        print(f"TCP Server listening on {TCP_HOST}:{TCP_PORT}")
+    ROOM_HANDLERS[msg_type](room, addr, *fields)
 
+
+async def handle_tcp_client(reader, writer):
+    addr = writer.get_extra_info("peername")
+    log.info("Client %s connected.", addr)
+    TCP_clients.append(writer)
+    frames = FrameReader()
+
+    try:
+        # Drain whatever arrived and handle every complete frame in it
         while True:
-            connection_socket, client_addr = tcp_server_socket.accept()
-            print(f"TCP Connection from {client_addr}")
-            threading.Thread(
-                target=handle_tcp_client,
-                args=(connection_socket, client_addr),
-                daemon=True,
-            ).start()
+            data = await reader.read(TCP_BUFFER_SIZE)
+            if not data:
+                break
+            if recorder is not None:
+                recorder.record(INBOUND, TCP, addr, data)
+
+            for kind, payload in frames.feed(data):
+                if kind == FRAME_SAMPLES:
+                    samples = len(payload) // SAMPLE.size
+                    registry.count("in", "FPGA_SAMPLE", len(payload), samples)
+                    with registry.timer("FPGA_SAMPLES"):
+                        for x, y, player_no, room_id in iter_samples(payload):
+                            route_fpga_data(room_id, x, y, player_no)
+                elif kind == FRAME_EXIT:
+                    log.info("Client %s requested exit.", addr)
+                    return
 
+    except Exception as e:
+        log.warning("Error handling client %s: %s", addr, e)
 
-def update_overlay():
-    global overlay_angle
-    while True:
-        if game_running:
-            overlay_angle = random.randint(-45, 45)
-            overlay_message = f"OVERLAY,{overlay_angle}"
-            send_to_all_clients(overlay_message)
-            print(f"Sent overlay angle: {overlay_angle}")
-        time.sleep(1)
+    finally:
+        log.info("Client %s disconnected.", addr)
+        TCP_clients.remove(writer)
+        writer.close()
 
 
-def send_fpga_data(x, y, player_no):
-    message = f"{x},{y},{player_no}"
-    send_to_all_clients(message)
-    print(f"Sent: {message}")  # debugging
+async def update_overlay():
+    while True:
+        for room in rooms.running_rooms():
+            room.overlay_angle = random.randint(-45, 45)
+            room.dirty = True
+        await asyncio.sleep(1)
 
 
-if __name__ == "__main__":
+async def expire_idle_clients():
+    """Forget clients that went quiet, so dead addresses stop getting
+    snapshots and abandoned rooms don't pile up."""
+    while True:
+        await asyncio.sleep(CLIENT_IDLE_TIMEOUT / 4)
+        expired = rooms.expire_idle(CLIENT_IDLE_TIMEOUT)
+        for addr in control.peers():
+            if rooms.room_of(addr) is None:
+                control.forget(addr)  # Left, replaced or expired
+        if expired:
+            log.info("Dropped %d idle clients, %d rooms left", expired, len(rooms.rooms))
+
+
+async def tick_loop():
+    """Send every changed room one SNAPSHOT per client per tick.
+
+    Score, overlay and FPGA position changes only mark the room dirty, so the
+    packet rate is bounded by TICK_RATE however fast input arrives."""
+    loop = asyncio.get_running_loop()
+    interval = 1 / TICK_RATE
+    keyframe_ticks = max(1, round(KEYFRAME_INTERVAL * TICK_RATE))
+    tick = 0
+    next_tick = loop.time()
+    while True:
+        tick += 1
+        keyframe = tick % keyframe_ticks == 0
+        for room in list(rooms.rooms.values()):
+            flush_snapshot(room, keyframe)
+        resend_control()
+        next_tick += interval
+        delay = next_tick - loop.time()
+        if delay < 0:
+            next_tick = loop.time()  # Fell behind, don't try to catch up in a burst
+            delay = 0
+        await asyncio.sleep(delay)
+
+
+def route_fpga_data(room_id, x, y, player_no):
+    owner = worker_for_room(room_id, num_workers)
+    if owner != worker_index:
+        sample = encode(POSITION, room_id, 0, x, y, player_no)
+        forward_transport.sendto(
+            pack_forward(FORWARD_FPGA_SAMPLE, ("0.0.0.0", 0), sample),
+            forward_address(owner),
+        )
+        return
+    send_fpga_data(room_id, x, y, player_no)
 
-    # Server setup for TCP connections
-    TCP_HOST = "0.0.0.0"  # Change this to the local DNS IPv4 address
-    TCP_PORT = 12000  # Port for TCP connections
-    TCP_BUFFER_SIZE = 1024
 
-    # Server setup
-    UDP_HOST = "0.0.0.0"  # Change this to the local DNS IPv4 address
-    UDP_PORT = 12345
-    UDP_BUFFER_SIZE = 1024
+def send_fpga_data(room_id, x, y, player_no):
+    room = rooms.rooms.get(room_id)
+    if room is None:
+        return  # Nobody has joined this room yet
+    room.set_position(player_no, x, y)
+    log.debug(
+        "Position in room %d: %d,%d,%d", room_id, x, y, player_no, extra=every(50)
+    )
 
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    server_socket.bind((UDP_HOST, UDP_PORT))
-    print(f"UDP Game Server started on {UDP_HOST}:{UDP_PORT}")
 
-    clients = {}  # Stores player IDs and their addresses
-    TCP_clients = []  # Stores TCP client sockets
-    players_ready = set()
-    boss_hp = 3000
-    overlay_angle = random.randint(-45, 45)
-    scores = {1: 0, 2: 0}  # Player scores
-    game_running = False
-    final_health = {1: 100, 2: 100}
+async def main():
+    """Run the UDP game port, the TCP FPGA port and the overlay timer on one loop."""
+    global forward_transport, fanout
+    loop = asyncio.get_running_loop()
+    sharded = num_workers > 1
+
+    if not sharded:
+        # Table setup is a blocking call, keep it off the loop
+        await loop.run_in_executor(None, storage.create_tables)
+    if not leaderboard.blocking:
+        await loop.run_in_executor(None, load_leaderboard)
+
+    game_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if sharded:
+        game_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    game_socket.bind((UDP_HOST, UDP_PORT))
+    # Broadcasts are sent on the socket directly, the transport only receives
+    fanout = FanOut(game_socket, recorder)
+    transport, _ = await loop.create_datagram_endpoint(
+        GameServerProtocol, sock=game_socket
+    )
+    log.info(
+        "UDP Game Server started on %s:%d (worker %d)", UDP_HOST, UDP_PORT, worker_index
+    )
 
-    # AWS DynamoDB Setup
-    dynamodb = boto3.resource("dynamodb", region_name="us-east-1")
-    table_name = "GameScores"
+    if sharded:
+        forward_transport, _ = await loop.create_datagram_endpoint(
+            ForwardProtocol, local_addr=forward_address(worker_index)
+        )
 
+    tcp_server = await asyncio.start_server(
+        handle_tcp_client, TCP_HOST, TCP_PORT, reuse_port=sharded
+    )
+    log.info("TCP Server listening on %s:%d", TCP_HOST, TCP_PORT)
 
-    threading.Thread(target=UDP_handle_client, daemon=True).start()
+    # Stop cleanly when the coordinator terminates us so queued results get saved
+    loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
 
-    threading.Thread(target=update_overlay, daemon=True).start()
+    metrics = None
+    if METRICS_PORT is not None:
+        metrics = registry.start(METRICS_HOST, METRICS_PORT + worker_index)
+    try:
+        async with tcp_server:
+            await asyncio.gather(
+                tcp_server.serve_forever(),
+                update_overlay(),
+                tick_loop(),
+                expire_idle_clients(),
+            )
+    finally:
+        if metrics is not None:
+            metrics.cancel()
+        transport.close()
+        if forward_transport is not None:
+            forward_transport.close()
+
+
+def run_worker(index, count):
+    global worker_index, num_workers, storage, leaderboard, game_ids, results_queue
+    global recorder
+    worker_index, num_workers = index, count
+    stop_logging = setup_logging()  # A forked worker needs its own writer thread
+    if RECORD_PATH:
+        # One log per worker, each sees its own share of the traffic
+        path = RECORD_PATH if count == 1 else f"{RECORD_PATH}.{index}"
+        recorder = Recorder(path)
+        log.info("Recording session to %s", path)
+    # Each process needs its own database connection
+    storage = open_storage()
+    if LEADERBOARD_MODE == "query":
+        leaderboard = QueryLeaderboard(storage)
+    else:
+        leaderboard = Leaderboard()
+    game_ids = GameIdGenerator(worker_index)
+    results_queue = WriteBehindQueue(
+        registry.timed("storage.save_game_results", storage.save_game_results)
+    )
+    try:
+        asyncio.run(main())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    finally:
+        log.info("Worker %d shutting down.", worker_index)
+        results_queue.close()  # Flush game results still waiting to be written
+        if recorder is not None:
+            recorder.close()
+        stop_logging()
 
-    create_table()
 
-    threading.Thread(target=start_tcp_server, daemon=True).start()
+if __name__ == "__main__":
 
-    while True:
-        time.sleep(1)  # Keeps the main thread alive
+    # Server setup for TCP connections
+    TCP_HOST = "0.0.0.0"  # Change this to the local DNS IPv4 address
+    TCP_PORT = 12000  # Port for TCP connections
+    TCP_BUFFER_SIZE = 65536  # Read as much of the FPGA stream as is buffered
 
-    server_socket.close()
+    # Server setup
+    UDP_HOST = "0.0.0.0"  # Change this to the local DNS IPv4 address
+    UDP_PORT = 12345
+    TICK_RATE = int(os.environ.get("TICK_RATE", 30))  # Snapshots per second (20, 30, 60)
+    KEYFRAME_INTERVAL = 2  # Seconds between full snapshots
+    CLIENT_IDLE_TIMEOUT = 120  # Seconds of silence before a client leaves its room
+    # Plaintext metrics for this worker on METRICS_PORT + worker index, clear of
+    # node_exporter's 9100 and server.py's 19090. METRICS_PORT=0 turns them off.
+    METRICS_HOST = "127.0.0.1"
+    METRICS_PORT = port_from_env(19100)
+
+    # Number of processes sharing the game ports through SO_REUSEPORT
+    NUM_WORKERS = int(os.environ.get("GAME_SERVER_WORKERS", 1))
+    worker_index, num_workers = 0, 1
+
+    fanout = None  # Sends on the game socket, set once it is bound
+    # Append every message in and out to this session log, for replay.py
+    RECORD_PATH = os.environ.get("RECORD_PATH")
+    recorder = None
+    forward_transport = None  # Only used when sharded across workers
+
+    rooms = RoomRegistry()  # Every concurrent game hosted by this process
+    # Acks and retransmits GAME_START, WAITING, HIGH_SCORES and GAME_OVER
+    control = ReliableChannel()
+    # "memory" ranks from an index loaded at startup, "query" asks the storage
+    # backend's score-ordered index on every game end
+    LEADERBOARD_MODE = os.environ.get("LEADERBOARD_MODE", "memory")
+    TCP_clients = []  # Stores TCP client stream writers
+
+    # Storage backend is chosen with STORAGE_BACKEND (dynamodb or sqlite)
+    if NUM_WORKERS > 1:
+        setup_logging()
+        open_storage().create_tables()  # Once, before forking the workers
+        run_workers(NUM_WORKERS, run_worker)
+    else:
+        run_worker(0, 1)
@@ -0,0 +1,59 @@
+import logging
+
+from logs import every
+from metrics import registry
+from protocol import MAX_DATAGRAM, MAX_MESSAGE, encode_fragments, peek_name
+from recording import OUTBOUND, UDP
+
+log = logging.getLogger(__name__)
+
+
+class FanOut:
+    """Sends one encoded datagram to many clients straight on the game socket.
+
+    Messages are encoded into a buffer reused for every send, and each
+    destination gets a plain non-blocking sendto. A send that would block or
+    fails is dropped for that destination only, game traffic is stale by the
+    next tick anyway, so nothing is queued behind it. Both are counted in the
+    metrics, under the "dropped" and "failed" directions."""
+
+    def __init__(self, sock, recorder=None):
+        sock.setblocking(False)
+        self.sock = sock
+        self.recorder = recorder
+        self.buffer = bytearray(MAX_MESSAGE)
+        self.view = memoryview(self.buffer)
+
+    def send(self, length, addrs):
+        """Send the first length bytes of the buffer to every address, return
+        how many went out."""
+        return self.send_data(self.view[:length], addrs)
+
+    def send_data(self, data, addrs):
+        if len(data) > MAX_DATAGRAM:
+            # Longer than a client reads at once, send it in pieces
+            pieces = encode_fragments(data)
+            return min(self.send_data(piece, addrs) for piece in pieces)
+        sendto = self.sock.sendto
+        sent = dropped = failed = 0
+        for addr in addrs:
+            try:
+                sendto(data, addr)
+                sent += 1
+            except BlockingIOError:
+                dropped += 1  # Socket buffer full
+            except OSError as e:
+                failed += 1
+                log.warning("Send to %s failed: %s", addr, e, extra=every(100))
+        if dropped:
+            registry.count("dropped", peek_name(data), len(data) * dropped, dropped)
+            log.warning(
+                "Socket buffer full, dropped %d sends", dropped, extra=every(100)
+            )
+        if failed:
+            registry.count("failed", peek_name(data), len(data) * failed, failed)
+        if self.recorder is not None:
+            payload = bytes(data)
+            for addr in addrs:
+                self.recorder.record(OUTBOUND, UDP, addr, payload)
+        return sent
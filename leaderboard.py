@@ -0,0 +1,147 @@
+import bisect
+
+TOP_SIZE = 5
+
+
+def best_score(game):
+    return max(game["player_1_score"], game["player_2_score"])
+
+
+class ScoreCounts:
+    """Fenwick tree counting games per best score, for O(log n) ranks."""
+
+    def __init__(self, size=1024):
+        self.tree = [0] * (size + 1)
+        self.total = 0
+
+    def _grow(self, score):
+        size = len(self.tree) - 1
+        while size <= score:
+            size *= 2
+        counts = [self.count_at(i) for i in range(len(self.tree) - 1)]
+        self.tree = [0] * (size + 1)
+        self.total = 0
+        for score_value, count in enumerate(counts):
+            if count:
+                self.add(score_value, count)
+
+    def add(self, score, count=1):
+        if score >= len(self.tree) - 1:
+            self._grow(score)
+        self.total += count
+        i = score + 1
+        while i < len(self.tree):
+            self.tree[i] += count
+            i += i & -i
+
+    def count_below(self, score):
+        """Number of games whose best score is lower than score."""
+        i = min(score, len(self.tree) - 1)
+        count = 0
+        while i > 0:
+            count += self.tree[i]
+            i -= i & -i
+        return count
+
+    def count_at(self, score):
+        return self.count_below(score + 1) - self.count_below(score)
+
+    def count_at_least(self, score):
+        return self.total - self.count_below(score)
+
+
+class Leaderboard:
+    """In-memory index of every finished game, loaded once at startup."""
+
+    blocking = False
+
+    def __init__(self, top_size=TOP_SIZE):
+        self.top_size = top_size
+        self.games = {}  # game ID -> game record
+        self.counts = ScoreCounts()
+        self.top = []  # (-best score, game ID) of the best games, best first
+
+    def load(self, games):
+        for game in games:
+            self.add(game)
+
+    def add(self, game):
+        game_id = game["game_id"]
+        if game_id in self.games:
+            return
+        score = max(best_score(game), 0)
+        self.games[game_id] = game
+        self.counts.add(score)
+
+        entry = (-score, game_id)
+        if len(self.top) < self.top_size or entry < self.top[-1]:
+            bisect.insort(self.top, entry)
+            del self.top[self.top_size :]
+
+    def rank(self, game_id):
+        """1-based rank by best score. Among equal scores the newest game, which
+        is the one just played, is ranked last."""
+        score = max(best_score(self.games[game_id]), 0)
+        return self.counts.count_at_least(score)
+
+    def high_scores(self, latest_game_id):
+        """Top games, plus the latest game with its rank if it missed the top."""
+        top_scores = [self.games[game_id] for _, game_id in self.top]
+        if latest_game_id not in self.games:
+            return top_scores
+
+        latest_game_rank = self.rank(latest_game_id)
+        if latest_game_rank > self.top_size:
+            latest_game = dict(self.games[latest_game_id], rank=latest_game_rank)
+            return top_scores + [latest_game]
+        return top_scores
+
+
+class QueryLeaderboard:
+    """Leaderboard answered by storage queries over a score-ordered index, so
+    nothing is loaded at startup and cost does not grow with history.
+
+    Blocking: call high_scores off the event loop."""
+
+    blocking = True
+
+    def __init__(self, storage, top_size=TOP_SIZE, recent_size=64):
+        self.storage = storage
+        self.top_size = top_size
+        self.recent_size = recent_size
+        # Games finished by this process, which may still be in the write queue
+        self.recent = {}
+
+    def add(self, game):
+        self.recent[game["game_id"]] = game
+        if len(self.recent) > self.recent_size:
+            del self.recent[next(iter(self.recent))]
+
+    def recent_high_scores(self):
+        """Top games among the ones finished here, for when storage fails."""
+        ranked = sorted(
+            self.recent.values(),
+            key=lambda game: (-best_score(game), game["game_id"]),
+        )
+        return ranked[: self.top_size]
+
+    def high_scores(self, latest_game_id):
+        recent = dict(self.recent)  # The event loop thread keeps adding games
+        candidates = dict(recent)
+        for game in self.storage.top_game_results(self.top_size):
+            candidates.setdefault(game["game_id"], game)
+        ranked = sorted(
+            candidates.values(), key=lambda game: (-best_score(game), game["game_id"])
+        )
+        top_scores = ranked[: self.top_size]
+
+        latest_game = recent.get(latest_game_id)
+        if latest_game is None or latest_game in top_scores:
+            return top_scores
+
+        # Ties rank the latest game last, as Leaderboard.rank does
+        latest_game_rank = self.storage.count_better_results(
+            best_score(latest_game), latest_game_id
+        )
+        latest_game_rank = max(latest_game_rank + 1, self.top_size + 1)
+        return top_scores + [dict(latest_game, rank=latest_game_rank)]
@@ -0,0 +1,353 @@
+"""Headless load generator for the game server.
+
+Starts N synthetic players speaking the UDP game protocol of
+clean_game_client.py and M synthetic FPGA boards speaking the TCP frame
+protocol of clean_client.py, then reports throughput, packet loss and
+score-to-snapshot latency percentiles.
+
+    python loadgen.py --players 200 --boards 20 --duration 30 --spawn
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from metrics import QUANTILES, Histogram
+from protocol import (
+    ACK,
+    CONTROL_MESSAGES,
+    FRAGMENT,
+    GAME_OVER,
+    GAME_START,
+    HIGH_SCORES,
+    PLAY_AGAIN,
+    PLAYER_ID,
+    SCORE,
+    SNAPSHOT,
+    SNAPSHOT_ACK,
+    ProtocolError,
+    Reassembler,
+    apply_snapshot,
+    decode,
+    decode_snapshot,
+    encode,
+    encode_samples,
+)
+from reliable import ReliableChannel
+
+SNAPSHOT_HISTORY = 32  # Baselines kept for deltas, as in the pygame client
+LOSS_TIMEOUT = 1.0  # Seconds after which an unanswered SCORE counts as lost
+
+
+class Stats:
+    """Counters shared by every synthetic client of one run."""
+
+    def __init__(self):
+        self.sent = {}  # message name -> datagrams sent
+        self.received = {}  # message name -> datagrams received
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latency = Histogram()  # SCORE sent -> SNAPSHOT showing it
+        self.scores_sent = 0
+        self.scores_seen = 0
+        self.scores_lost = 0
+        self.snapshot_gaps = 0  # Snapshots skipped over by a newer one
+        self.games_started = 0
+        self.samples_sent = 0
+
+    def count_sent(self, name, nbytes):
+        self.sent[name] = self.sent.get(name, 0) + 1
+        self.bytes_sent += nbytes
+
+    def count_received(self, name, nbytes):
+        self.received[name] = self.received.get(name, 0) + 1
+        self.bytes_received += nbytes
+
+
+class SyntheticPlayer(asyncio.DatagramProtocol):
+    """One pygame-free client: joins a room, scores at a fixed rate while a
+    game runs, acknowledges snapshots and asks to play again."""
+
+    def __init__(self, stats, room_id, player_id, score_rate):
+        self.stats = stats
+        self.room_id = room_id
+        self.player_id = player_id
+        self.score_rate = score_rate
+        self.transport = None
+        self.seq = 0
+        self.control = ReliableChannel()  # Peer address None, the socket is connected
+        self.control_seq = random.getrandbits(31)
+        self.reassembler = Reassembler()
+        self.playing = False
+        self.round_scores = 0  # SCOREs sent this round
+        self.pending = {}  # score value -> time the SCORE was sent
+        self.history = {}  # snapshot seq -> state, delta baselines
+        self.latest_seq = 0
+
+    def send(self, msg_type, name, *fields):
+        if msg_type in CONTROL_MESSAGES:
+            self.control_seq += 1
+            data = encode(msg_type, self.room_id, self.control_seq, *fields)
+            self.control.sent(None, self.control_seq, data)
+        else:
+            self.seq += 1
+            data = encode(msg_type, self.room_id, self.seq, *fields)
+        self.transport.sendto(data)
+        self.stats.count_sent(name, len(data))
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.send(PLAYER_ID, "PLAYER_ID", self.player_id)
+
+    def datagram_received(self, data, addr):
+        try:
+            msg_type, _, seq, fields = decode(data)
+            if msg_type == FRAGMENT:
+                self.stats.count_received("FRAGMENT", len(data))
+                data = self.reassembler.feed(None, data)
+                if data is None:
+                    return
+                msg_type, _, seq, fields = decode(data)
+        except ProtocolError:
+            self.stats.count_received("INVALID", len(data))
+            return
+        if msg_type == ACK:
+            self.stats.count_received("ACK", len(data))
+            self.control.acknowledge(None, *fields)
+            return
+        if msg_type in CONTROL_MESSAGES:
+            new, newest, bits = self.control.receive(None, seq)
+            self.send(ACK, "ACK", newest, bits)
+            if not new:
+                self.stats.count_received("DUPLICATE", len(data))
+                return
+        if msg_type == SNAPSHOT:
+            self.stats.count_received("SNAPSHOT", len(data))
+            self.on_snapshot(seq, *fields)
+        elif msg_type == GAME_START:
+            self.stats.count_received("GAME_START", len(data))
+            self.start_round()
+        elif msg_type == HIGH_SCORES:
+            self.stats.count_received("HIGH_SCORES", len(data))
+            self.playing = False
+            self.expire_pending(0)
+            # Linger on the high score screen like a person would
+            delay = random.uniform(0.5, 1.5)
+            asyncio.get_running_loop().call_later(
+                delay, self.send, PLAY_AGAIN, "PLAY_AGAIN", self.player_id
+            )
+        else:
+            self.stats.count_received(str(msg_type), len(data))
+
+    def start_round(self):
+        self.stats.games_started += 1
+        self.expire_pending(0)
+        self.playing = True
+        self.round_scores = 0
+
+    def on_snapshot(self, seq, payload):
+        baseline_seq, mask, values = decode_snapshot(payload)
+        if not baseline_seq and self.history and seq < min(self.history):
+            # A keyframe older than all we kept: the room was recreated
+            self.history.clear()
+            self.latest_seq = 0
+        baseline = self.history.get(baseline_seq) if baseline_seq else None
+        if baseline_seq and baseline is None:
+            return  # Baseline forgotten, wait for the next keyframe
+        state = apply_snapshot(baseline, mask, values)
+        self.history[seq] = state
+        if len(self.history) > SNAPSHOT_HISTORY:
+            del self.history[min(self.history)]
+        self.send(SNAPSHOT_ACK, "SNAPSHOT_ACK", seq)
+        if seq <= self.latest_seq:
+            return
+        if self.latest_seq:
+            self.stats.snapshot_gaps += seq - self.latest_seq - 1
+        self.latest_seq = seq
+
+        boss_hp, score = state[0], state[1 + self.player_id]
+        now = time.perf_counter()
+        for value in [value for value in self.pending if value <= score]:
+            self.stats.latency.record(now - self.pending.pop(value))
+            self.stats.scores_seen += 1
+        if self.playing and boss_hp <= 0:
+            self.playing = False
+            self.send(GAME_OVER, "GAME_OVER", self.player_id, 100)
+
+    def expire_pending(self, timeout):
+        """Count SCOREs unanswered for timeout seconds as lost."""
+        now = time.perf_counter()
+        for value, sent in list(self.pending.items()):
+            if now - sent >= timeout:
+                del self.pending[value]
+                self.stats.scores_lost += 1
+
+    async def run(self, stop):
+        interval = 1 / self.score_rate
+        # Spread the clients out so they don't all send on the same tick
+        await asyncio.sleep(random.uniform(0, interval))
+        while not stop.is_set():
+            if self.playing:
+                self.round_scores += 1
+                self.pending[self.round_scores] = time.perf_counter()
+                self.stats.scores_sent += 1
+                self.send(SCORE, "SCORE", self.player_id)
+            self.expire_pending(LOSS_TIMEOUT)
+            for data, _ in self.control.due():
+                self.transport.sendto(data)
+                self.stats.count_sent("RETRANSMIT", len(data))
+            await asyncio.sleep(interval)
+        self.expire_pending(LOSS_TIMEOUT)
+        self.stats.scores_lost += len(self.pending)  # Still in flight at the end
+
+
+async def fpga_feeder(host, port, room_id, player_no, sample_rate, stats, stop):
+    """One synthetic FPGA board, batching samples like clean_client.py."""
+    _, writer = await asyncio.open_connection(host, port)
+    batch_interval = 0.05
+    per_batch = max(1, round(sample_rate * batch_interval))
+    try:
+        while not stop.is_set():
+            samples = [
+                (random.randint(0, 7000), random.randint(0, 7000), player_no, room_id)
+                for _ in range(per_batch)
+            ]
+            data = encode_samples(samples)
+            writer.write(data)
+            await writer.drain()
+            stats.count_sent("FPGA_SAMPLES", len(data))
+            stats.samples_sent += per_batch
+            await asyncio.sleep(batch_interval)
+    finally:
+        writer.close()
+
+
+async def run_load(args):
+    loop = asyncio.get_running_loop()
+    stats = Stats()
+    stop = asyncio.Event()
+    players = []
+    transports = []
+    for i in range(args.players):
+        room_id = args.first_room + i // 2
+        player = SyntheticPlayer(stats, room_id, i % 2 + 1, args.score_rate)
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda player=player: player, remote_addr=(args.host, args.udp_port)
+        )
+        players.append(player)
+        transports.append(transport)
+
+    rooms = max(1, (args.players + 1) // 2)
+    tasks = [asyncio.create_task(player.run(stop)) for player in players]
+    tasks += [
+        asyncio.create_task(
+            fpga_feeder(
+                args.host,
+                args.tcp_port,
+                args.first_room + i % rooms,
+                i // rooms % 2 + 1,
+                args.sample_rate,
+                stats,
+                stop,
+            )
+        )
+        for i in range(args.boards)
+    ]
+
+    started = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    stop.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    for transport in transports:
+        transport.close()
+    return report(stats, elapsed)
+
+
+def report(stats, elapsed):
+    answered = stats.scores_seen + stats.scores_lost
+    return {
+        "elapsed_seconds": round(elapsed, 2),
+        "games_started": stats.games_started,
+        "datagrams_sent_per_second": round(sum(stats.sent.values()) / elapsed, 1),
+        "datagrams_received_per_second": round(
+            sum(stats.received.values()) / elapsed, 1
+        ),
+        "bytes_sent_per_second": round(stats.bytes_sent / elapsed),
+        "bytes_received_per_second": round(stats.bytes_received / elapsed),
+        "fpga_samples_per_second": round(stats.samples_sent / elapsed, 1),
+        "scores_sent": stats.scores_sent,
+        "score_loss": round(stats.scores_lost / answered, 4) if answered else 0.0,
+        "snapshot_gaps": stats.snapshot_gaps,
+        "update_latency_ms": {
+            f"p{round(q * 100)}": round(stats.latency.quantile(q) * 1000, 3)
+            for q in QUANTILES
+        },
+        "sent": stats.sent,
+        "received": stats.received,
+    }
+
+
+def spawn_server(args):
+    """Start clean_info_server_official.py on a throwaway SQLite database."""
+    path = os.path.join(tempfile.mkdtemp(prefix="loadgen-"), "loadgen.db")
+    env = dict(
+        os.environ, STORAGE_BACKEND="sqlite", SQLITE_PATH=path, LOG_LEVEL="WARNING"
+    )
+    script = os.path.join(os.path.dirname(__file__), "clean_info_server_official.py")
+    server = subprocess.Popen([sys.executable, script], env=env)
+    time.sleep(args.spawn_wait)
+    if server.poll() is not None:
+        raise SystemExit(f"Server exited with {server.returncode}")
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--udp-port", type=int, default=12345)
+    parser.add_argument("--tcp-port", type=int, default=12000)
+    parser.add_argument(
+        "--players", type=int, default=100, help="Synthetic game clients, two per room"
+    )
+    parser.add_argument("--boards", type=int, default=10, help="Synthetic FPGA boards")
+    parser.add_argument(
+        "--score-rate", type=float, default=5, help="SCOREs per second per player"
+    )
+    parser.add_argument(
+        "--sample-rate", type=float, default=50, help="Samples per second per board"
+    )
+    parser.add_argument("--duration", type=float, default=20, help="Seconds of load")
+    parser.add_argument("--first-room", type=int, default=1)
+    parser.add_argument(
+        "--spawn", action="store_true", help="Start a local server on SQLite"
+    )
+    parser.add_argument(
+        "--spawn-wait", type=float, default=2, help="Seconds to let the server start"
+    )
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    server = spawn_server(args) if args.spawn else None
+    try:
+        result = asyncio.run(run_load(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    for key, value in result.items():
+        print(f"{key:32} {value}")
+
+
+if __name__ == "__main__":
+    main()
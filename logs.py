@@ -0,0 +1,86 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+def every(n):
+    """Extra for a hot-path log call that should only go out once per n calls,
+    e.g. log.debug("Position %s", pos, extra=every(100))."""
+    return {"sample_every": n}
+
+
+class SampleFilter(logging.Filter):
+    """Lets through one in n records from each call site that asks for it."""
+
+    def __init__(self):
+        super().__init__()
+        self.seen = {}  # (file, line) -> records from that call site
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        n = getattr(record, "sample_every", 1)
+        if n <= 1:
+            return True
+        key = (record.pathname, record.lineno)
+        with self.lock:
+            seen = self.seen.get(key, 0)
+            self.seen[key] = seen + 1
+        if seen % n:
+            return False
+        if seen:
+            record.msg = f"{record.msg} [1 of {n}]"
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread, dropping them when it falls behind
+    rather than blocking the caller."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(level=None, queue_size=10000, stream=None):
+    """Send every log record through a bounded queue to a background writer
+    thread. The level comes from LOG_LEVEL (default INFO). Call once per
+    process, forked workers call it again for their own writer thread.
+
+    Returns a function that flushes the queue and stops the writer. It also
+    runs at exit, but forked workers exit without atexit and must call it."""
+    level = level or os.environ.get("LOG_LEVEL", "INFO").upper()
+    log_queue = queue.Queue(queue_size)
+    handler = DroppingQueueHandler(log_queue)
+    handler.addFilter(SampleFilter())
+
+    writer = logging.StreamHandler(stream or sys.stdout)
+    writer.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = logging.handlers.QueueListener(log_queue, writer)
+    listener.start()
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+
+    def stop():
+        if listener._thread is None:
+            return  # Already stopped
+        listener.stop()  # Writes out whatever is still queued
+        if handler.dropped:
+            writer.stream.write(f"{handler.dropped} log records dropped\n")
+            writer.flush()
+
+    atexit.register(stop)
+    return stop
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+# Latencies are kept in microseconds in log-linear buckets: every power of two
+# is split into 2**SUB_BUCKET_BITS equal steps, so a bucket is never more than
+# 1/2**SUB_BUCKET_BITS wider than its lower bound (12.5% with 3 bits).
+SUB_BUCKET_BITS = 3
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+MAX_EXPONENT = 40  # Microseconds up to 2**40, about 12 days
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def bucket_index(value):
+    """Bucket of a non-negative integer, linear below SUB_BUCKETS."""
+    if value < SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    return ((shift + 1) << SUB_BUCKET_BITS) + (value >> shift) - SUB_BUCKETS
+
+
+def bucket_upper_bound(index):
+    """Largest value that falls into the bucket."""
+    if index < SUB_BUCKETS:
+        return index
+    shift = (index >> SUB_BUCKET_BITS) - 1
+    mantissa = (index & (SUB_BUCKETS - 1)) + SUB_BUCKETS
+    return ((mantissa + 1) << shift) - 1
+
+
+class Histogram:
+    """Fixed-size latency histogram, recording is a bit_length and an add."""
+
+    def __init__(self):
+        self.counts = [0] * ((MAX_EXPONENT + 1) << SUB_BUCKET_BITS)
+        self.count = 0
+        self.total = 0.0  # Seconds
+
+    def record(self, seconds):
+        micros = min(int(seconds * 1e6), (1 << MAX_EXPONENT) - 1)
+        self.counts[bucket_index(micros)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q quantile, in seconds."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                return bucket_upper_bound(index) / 1e6
+        return bucket_upper_bound(len(self.counts) - 1) / 1e6
+
+
+class MetricsRegistry:
+    """Packet and byte counters per message type and latency histograms per
+    handler, shared by the event loop and storage threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.messages = {}  # (direction, message type) -> [packets, bytes]
+        self.latencies = {}  # handler name -> Histogram
+        self.started = time.time()
+
+    def count(self, direction, msg_name, nbytes, packets=1):
+        key = (direction, msg_name)
+        with self.lock:
+            counter = self.messages.get(key)
+            if counter is None:
+                counter = self.messages[key] = [0, 0]
+            counter[0] += packets
+            counter[1] += nbytes
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.latencies.get(name)
+            if histogram is None:
+                histogram = self.latencies[name] = Histogram()
+            histogram.record(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def timed(self, name, func):
+        """Wrap func so every call is recorded under name."""
+
+        def wrapper(*args, **kwargs):
+            with self.timer(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    def render(self):
+        """Plaintext snapshot of every metric, one sample per line."""
+        with self.lock:
+            messages = sorted(
+                (key, list(counter)) for key, counter in self.messages.items()
+            )
+            latencies = [
+                (name, histogram.count, histogram.total)
+                + tuple(histogram.quantile(q) for q in QUANTILES)
+                for name, histogram in sorted(self.latencies.items())
+            ]
+        lines = [f"uptime_seconds {time.time() - self.started:.0f}"]
+        for (direction, msg_name), (packets, nbytes) in messages:
+            labels = f'direction="{direction}",type="{msg_name}"'
+            lines.append(f"packets_total{{{labels}}} {packets}")
+            lines.append(f"bytes_total{{{labels}}} {nbytes}")
+        for name, count, total, *quantiles in latencies:
+            for q, value in zip(QUANTILES, quantiles):
+                lines.append(
+                    f'latency_seconds{{handler="{name}",quantile="{q}"}} {value:.6f}'
+                )
+            lines.append(f'latency_seconds_count{{handler="{name}"}} {count}')
+            lines.append(f'latency_seconds_sum{{handler="{name}"}} {total:.6f}')
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, host="127.0.0.1", port=9100):
+        """Answer every connection on host:port with a snapshot, over plain
+        HTTP so both curl and a browser work."""
+
+        async def handle(reader, writer):
+            try:
+                await asyncio.wait_for(reader.readline(), timeout=1)
+            except asyncio.TimeoutError:
+                pass  # Raw TCP client such as nc, answer anyway
+            body = self.render().encode()
+            writer.write(
+                b"HTTP/1.0 200 OK\r\nContent-Type: text/plain\r\n"
+                b"Content-Length: %d\r\n\r\n%s" % (len(body), body)
+            )
+            try:
+                await writer.drain()
+            finally:
+                writer.close()
+
+        try:
+            server = await asyncio.start_server(handle, host, port)
+        except OSError as e:
+            # Metrics are optional, a taken port must not stop the game
+            log.warning("Metrics endpoint on %s:%d disabled: %s", host, port, e)
+            return
+        log.info("Metrics on http://%s:%d/", host, port)
+        async with server:
+            await server.serve_forever()
+
+
+    def start(self, host, port):
+        """Serve in a task of its own, return it (None if port is None)."""
+        if port is None:
+            return None
+        return asyncio.get_running_loop().create_task(self.serve(host, port))
+
+
+def port_from_env(default):
+    """Metrics port from METRICS_PORT, default when the variable isn't set.
+    Set to empty or 0 to turn the endpoint off, which returns None."""
+    value = os.environ.get("METRICS_PORT", str(default)).strip()
+    return int(value) or None if value else None
+
+
+# One registry per process
+registry = MetricsRegistry()
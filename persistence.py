@@ -0,0 +1,117 @@
+import logging
+import queue
+import random
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class GameIdGenerator:
+    """Unique, increasing game IDs handed out before anything is stored.
+
+    IDs are millisecond timestamps with the worker index in the last two
+    digits, so sharded workers never hand out the same ID."""
+
+    def __init__(self, worker_index=0):
+        self.worker_index = worker_index
+        self.last = 0
+        self.lock = threading.Lock()
+
+    def next_id(self):
+        with self.lock:
+            game_id = int(time.time() * 1000) * 100 + self.worker_index
+            if game_id <= self.last:
+                game_id = self.last + 100
+            self.last = game_id
+            return game_id
+
+
+class WriteBehindQueue:
+    """Stores game results from a background thread so callers never wait on
+    the database. Results are written in batches and retried with backoff."""
+
+    def __init__(
+        self,
+        write_batch,
+        batch_size=25,
+        flush_interval=0.5,
+        max_retries=5,
+        retry_delay=0.2,
+    ):
+        self.write_batch = write_batch  # Callable storing a list of items
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.queue = queue.Queue()
+        self.in_flight = 0  # Results taken off the queue but not yet written
+        self.thread = threading.Thread(
+            target=self._run, name="write-behind", daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, item):
+        self.queue.put(item)
+
+    def retry_budget(self):
+        """Longest one batch can spend in backoff sleeps before it is dropped."""
+        return sum(
+            self.retry_delay * (2**attempt) * 1.5 for attempt in range(self.max_retries)
+        )
+
+    def close(self, timeout=None):
+        """Write everything still queued, then stop the writer thread. By default
+        waits long enough for a batch to go through every retry."""
+        if timeout is None:
+            timeout = self.flush_interval + self.retry_budget() + 10
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            # The stop marker may still be queued behind the results
+            dropped = self.in_flight + max(self.queue.qsize() - 1, 0)
+            log.error(
+                "Writer still busy after %.1fs, %d game results lost", timeout, dropped
+            )
+
+    def _run(self):
+        batch = []
+        stopping = False
+        while not stopping:
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+                self.in_flight = len(batch)
+            if batch:
+                self._write(batch)
+                self.in_flight = 0
+                batch = []
+
+    def _write(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.write_batch(batch)
+                log.info("Saved %d game results to the database.", len(batch))
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    log.error("Giving up on %d game results: %s", len(batch), e)
+                    return
+                # Exponential backoff with jitter
+                delay = self.retry_delay * (2**attempt) * random.uniform(0.5, 1.5)
+                log.warning(
+                    "Saving game results failed (%s), retrying in %.2fs", e, delay
+                )
+                time.sleep(delay)
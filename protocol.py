@@ -0,0 +1,383 @@
+import struct
+import time
+
+# Every datagram between the game server and the pygame client starts with
+# this header. The payload after it has a fixed layout per message type.
+PROTOCOL_VERSION = 1
+HEADER = struct.Struct("!BBHI")  # version, message type, room ID, sequence number
+
+# Client -> server
+HELLO = 1
+PLAYER_ID = 2  # player
+SCORE = 3  # player
+GAME_OVER = 4  # player, remaining health
+PLAY_AGAIN = 5  # player
+SNAPSHOT_ACK = 6  # sequence number of the newest snapshot received
+ACK = 7  # newest control message received, bit mask of the 32 before it (both ways)
+
+# Server -> client
+GAME_START = 16
+WAITING = 17  # player
+POSITION = 20  # x, y, player (FPGA sample handed between server workers)
+HIGH_SCORES = 21  # JSON encoded leaderboard
+SNAPSHOT = 22  # baseline, changed field mask, changed snapshot fields
+FRAGMENT = 23  # message type, index, count, total length, piece of a long datagram
+
+# Sent on the reliable channel (reliable.py): the header sequence number counts
+# control messages only, and each one is acknowledged with an ACK
+CONTROL_MESSAGES = frozenset({GAME_OVER, GAME_START, WAITING, HIGH_SCORES})
+
+BLOB = None  # Payload is the raw bytes after the header
+
+PAYLOADS = {
+    HELLO: struct.Struct("!"),
+    PLAYER_ID: struct.Struct("!B"),
+    SCORE: struct.Struct("!B"),
+    GAME_OVER: struct.Struct("!Bh"),
+    PLAY_AGAIN: struct.Struct("!B"),
+    SNAPSHOT_ACK: struct.Struct("!I"),
+    ACK: struct.Struct("!II"),
+    GAME_START: struct.Struct("!"),
+    WAITING: struct.Struct("!B"),
+    POSITION: struct.Struct("!HHB"),
+    HIGH_SCORES: BLOB,
+    SNAPSHOT: BLOB,
+    FRAGMENT: BLOB,
+}
+
+MESSAGE_NAMES = {
+    HELLO: "HELLO",
+    PLAYER_ID: "PLAYER_ID",
+    SCORE: "SCORE",
+    GAME_OVER: "GAME_OVER",
+    PLAY_AGAIN: "PLAY_AGAIN",
+    SNAPSHOT_ACK: "SNAPSHOT_ACK",
+    ACK: "ACK",
+    GAME_START: "GAME_START",
+    WAITING: "WAITING",
+    POSITION: "POSITION",
+    HIGH_SCORES: "HIGH_SCORES",
+    SNAPSHOT: "SNAPSHOT",
+    FRAGMENT: "FRAGMENT",
+}
+
+# Indexed by the message type byte so decoding is a single list lookup
+_DECODERS = [False] * 256
+for _msg_type, _payload in PAYLOADS.items():
+    _DECODERS[_msg_type] = _payload
+
+
+# A SNAPSHOT payload is the sequence number of the snapshot it is a delta
+# against (0 for a full keyframe), a bit mask of the fields that changed
+# since then, and the changed fields in order. Snapshot fields are:
+# boss HP, overlay angle, score 1, score 2, angle 1, angle 2, flags.
+SNAPSHOT_HEADER = struct.Struct("!IB")
+SNAPSHOT_FIELDS = "hbIIhhB"
+FULL_SNAPSHOT = (1 << len(SNAPSHOT_FIELDS)) - 1
+
+# Bits of the snapshot flags byte
+FLAG_GREEN = {1: 0x01, 2: 0x02}  # Player is holding the board upright
+FLAG_ATTACK = {1: 0x04, 2: 0x08}  # Boss is attacking the player
+
+# Indexed by field mask, one layout for every combination of changed fields
+_SNAPSHOT_LAYOUTS = [
+    struct.Struct(
+        "!" + "".join(f for i, f in enumerate(SNAPSHOT_FIELDS) if mask >> i & 1)
+    )
+    for mask in range(FULL_SNAPSHOT + 1)
+]
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def encode(msg_type, room_id=0, seq=0, *fields):
+    payload = PAYLOADS[msg_type]
+    header = HEADER.pack(PROTOCOL_VERSION, msg_type, room_id, seq & 0xFFFFFFFF)
+    if payload is BLOB:
+        return header + fields[0]
+    return header + payload.pack(*fields)
+
+
+def encode_into(buffer, msg_type, room_id=0, seq=0, *fields):
+    """Encode like encode() into a preallocated bytearray, return the length."""
+    payload = PAYLOADS[msg_type]
+    HEADER.pack_into(buffer, 0, PROTOCOL_VERSION, msg_type, room_id, seq & 0xFFFFFFFF)
+    if payload is BLOB:
+        end = HEADER.size + len(fields[0])
+        if end > len(buffer):
+            raise ProtocolError(f"{MESSAGE_NAMES[msg_type]} of {end} bytes too large")
+        buffer[HEADER.size : end] = fields[0]
+        return end
+    payload.pack_into(buffer, HEADER.size, *fields)
+    return HEADER.size + payload.size
+
+
+def decode(data):
+    """Return (message type, room ID, sequence number, payload fields)."""
+    if len(data) < HEADER.size:
+        raise ProtocolError(f"Datagram too short: {len(data)} bytes")
+    version, msg_type, room_id, seq = HEADER.unpack_from(data)
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}")
+    payload = _DECODERS[msg_type]
+    if payload is BLOB:
+        return msg_type, room_id, seq, (bytes(data[HEADER.size :]),)
+    if payload is False:
+        raise ProtocolError(f"Unknown message type {msg_type}")
+    try:
+        return msg_type, room_id, seq, payload.unpack_from(data, HEADER.size)
+    except struct.error as e:
+        raise ProtocolError(f"Bad {MESSAGE_NAMES[msg_type]} payload: {e}")
+
+
+def peek_room(data):
+    """Room ID of a datagram without decoding its payload."""
+    return HEADER.unpack_from(data)[2]
+
+
+def peek_name(data):
+    """Message type name of a datagram, for counting before it is decoded."""
+    if len(data) < HEADER.size:
+        return "INVALID"
+    return MESSAGE_NAMES.get(data[1], "UNKNOWN")
+
+
+def snapshot_mask(baseline, state):
+    """Bit mask of the fields of state that differ from baseline."""
+    if baseline is None:
+        return FULL_SNAPSHOT
+    mask = 0
+    for i in range(len(SNAPSHOT_FIELDS)):
+        if baseline[i] != state[i]:
+            mask |= 1 << i
+    return mask
+
+
+def encode_snapshot(room_id, seq, baseline_seq, mask, state):
+    fields = [value for i, value in enumerate(state) if mask >> i & 1]
+    return (
+        HEADER.pack(PROTOCOL_VERSION, SNAPSHOT, room_id, seq)
+        + SNAPSHOT_HEADER.pack(baseline_seq, mask)
+        + _SNAPSHOT_LAYOUTS[mask].pack(*fields)
+    )
+
+
+def encode_snapshot_into(buffer, room_id, seq, baseline_seq, mask, state):
+    """Encode like encode_snapshot() into a preallocated bytearray, return the
+    length."""
+    fields = [value for i, value in enumerate(state) if mask >> i & 1]
+    layout = _SNAPSHOT_LAYOUTS[mask]
+    HEADER.pack_into(buffer, 0, PROTOCOL_VERSION, SNAPSHOT, room_id, seq)
+    SNAPSHOT_HEADER.pack_into(buffer, HEADER.size, baseline_seq, mask)
+    layout.pack_into(buffer, HEADER.size + SNAPSHOT_HEADER.size, *fields)
+    return HEADER.size + SNAPSHOT_HEADER.size + layout.size
+
+
+def decode_snapshot(payload):
+    """Return (baseline sequence number, field mask, changed field values)."""
+    try:
+        baseline_seq, mask = SNAPSHOT_HEADER.unpack_from(payload)
+        values = _SNAPSHOT_LAYOUTS[mask].unpack_from(payload, SNAPSHOT_HEADER.size)
+    except (struct.error, IndexError) as e:
+        raise ProtocolError(f"Bad SNAPSHOT payload: {e}")
+    return baseline_seq, mask, values
+
+
+def apply_snapshot(baseline, mask, values):
+    """Rebuild the full snapshot state from a baseline and a delta."""
+    state = list(baseline) if baseline is not None else [0] * len(SNAPSHOT_FIELDS)
+    changed = iter(values)
+    for i in range(len(SNAPSHOT_FIELDS)):
+        if mask >> i & 1:
+            state[i] = next(changed)
+    return tuple(state)
+
+
+# Clients read datagrams into a MAX_DATAGRAM byte buffer, below the Ethernet
+# MTU, so a longer one is cut into FRAGMENTs. A fragment has the room and
+# sequence number of the datagram it was cut from, so pieces of a
+# retransmission fill the gaps left by the first attempt.
+MAX_DATAGRAM = 1024
+FRAGMENT_HEADER = struct.Struct("!BBBI")  # message type, index, count, total length
+FRAGMENT_PIECE = MAX_DATAGRAM - HEADER.size - FRAGMENT_HEADER.size
+MAX_FRAGMENTS = 255
+MAX_MESSAGE = MAX_FRAGMENTS * FRAGMENT_PIECE
+
+
+def encode_fragments(data):
+    """Cut an encoded datagram into FRAGMENT datagrams of at most MAX_DATAGRAM."""
+    if len(data) > MAX_MESSAGE:
+        raise ProtocolError(f"Datagram of {len(data)} bytes too long to fragment")
+    _, msg_type, room_id, seq = HEADER.unpack_from(data)
+    count = -(-len(data) // FRAGMENT_PIECE)
+    header = HEADER.pack(PROTOCOL_VERSION, FRAGMENT, room_id, seq)
+    return [
+        header
+        + FRAGMENT_HEADER.pack(msg_type, index, count, len(data))
+        + data[index * FRAGMENT_PIECE : (index + 1) * FRAGMENT_PIECE]
+        for index in range(count)
+    ]
+
+
+class Reassembler:
+    """Puts FRAGMENTs back together into the datagram they were cut from.
+
+    The first piece to arrive allocates a buffer of the full length, every
+    piece is copied straight to its place in it, in any order. Messages not
+    completed within timeout seconds are dropped, and so is the oldest one
+    when max_messages are in progress."""
+
+    def __init__(self, timeout=5.0, max_messages=16):
+        self.timeout = timeout
+        self.max_messages = max_messages
+        # (sender, room, seq, message type) -> [buffer, pieces missing, started]
+        self.partial = {}
+
+    def feed(self, sender, data, now=None):
+        """Add one FRAGMENT datagram, return the whole datagram once every
+        piece arrived, None until then."""
+        now = time.monotonic() if now is None else now
+        for key in [k for k, m in self.partial.items() if now - m[2] > self.timeout]:
+            del self.partial[key]
+
+        _, _, room_id, seq = HEADER.unpack_from(data)
+        try:
+            msg_type, index, count, total = FRAGMENT_HEADER.unpack_from(
+                data, HEADER.size
+            )
+        except struct.error as e:
+            raise ProtocolError(f"Bad FRAGMENT header: {e}")
+        start = index * FRAGMENT_PIECE
+        piece = memoryview(data)[HEADER.size + FRAGMENT_HEADER.size :]
+        if (
+            index >= count
+            or count != -(-total // FRAGMENT_PIECE)
+            or len(piece) != min(FRAGMENT_PIECE, total - start)
+        ):
+            raise ProtocolError(f"FRAGMENT {index}/{count} of {total} bytes")
+
+        key = (sender, room_id, seq, msg_type)
+        message = self.partial.get(key)
+        if message is None:
+            if len(self.partial) >= self.max_messages:
+                del self.partial[min(self.partial, key=lambda k: self.partial[k][2])]
+            message = self.partial[key] = [bytearray(total), set(range(count)), now]
+        buffer, missing, _ = message
+        if len(buffer) != total:
+            raise ProtocolError(f"FRAGMENT total {total} changed from {len(buffer)}")
+        if index in missing:
+            buffer[start : start + len(piece)] = piece
+            missing.discard(index)
+        if missing:
+            return None
+        del self.partial[key]
+        return buffer
+
+
+# The FPGA feed is a TCP stream of frames: payload length, frame kind, payload.
+# A samples frame carries a batch of fixed-width accelerometer samples.
+FRAME_HEADER = struct.Struct("!HB")
+FRAME_SAMPLES = 1
+FRAME_EXIT = 2
+SAMPLE = struct.Struct("!HHBH")  # x, y, player, room
+MAX_FRAME_SAMPLES = 0xFFFF // SAMPLE.size
+
+
+def encode_frame(kind, payload=b""):
+    return FRAME_HEADER.pack(len(payload), kind) + payload
+
+
+def encode_samples(samples):
+    """Samples frames for a batch of (x, y, player, room) tuples, as many as
+    it takes to keep each within MAX_FRAME_SAMPLES."""
+    samples = list(samples)
+    return b"".join(
+        encode_frame(
+            FRAME_SAMPLES,
+            b"".join(
+                SAMPLE.pack(*sample)
+                for sample in samples[start : start + MAX_FRAME_SAMPLES]
+            ),
+        )
+        for start in range(0, len(samples), MAX_FRAME_SAMPLES)
+    )
+
+
+def iter_samples(payload):
+    return SAMPLE.iter_unpack(payload)
+
+
+class FrameReader:
+    """Reassembles frames from a byte stream, whatever the TCP segmenting."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """Add received bytes, return every frame completed as (kind, payload)."""
+        self.buffer += data
+        frames = []
+        offset = 0
+        end = len(self.buffer)
+        while end - offset >= FRAME_HEADER.size:
+            length, kind = FRAME_HEADER.unpack_from(self.buffer, offset)
+            start = offset + FRAME_HEADER.size
+            if end - start < length:
+                break
+            frames.append((kind, bytes(self.buffer[start : start + length])))
+            offset = start + length
+        if offset:
+            del self.buffer[:offset]
+        return frames
+
+
+# Game info lookups on the game-info server share the same framing. A request
+# carries many game IDs and a request ID. The response echoes the request ID,
+# so a client can pipeline several requests on one connection.
+FRAME_INFO_REQUEST = 3
+FRAME_INFO_RESPONSE = 4
+FRAME_INFO_ERROR = 5  # Request ID, then an error message
+INFO_REQUEST = struct.Struct("!IH")  # request ID, number of game IDs
+INFO_RESPONSE = struct.Struct("!I")  # request ID, then a JSON object by game ID
+GAME_ID = struct.Struct("!I")
+MAX_INFO_IDS = 100  # Most keys a single DynamoDB BatchGetItem accepts
+
+
+def encode_info_request(request_id, game_ids):
+    if len(game_ids) > MAX_INFO_IDS:
+        raise ProtocolError(f"At most {MAX_INFO_IDS} game IDs per request")
+    payload = INFO_REQUEST.pack(request_id, len(game_ids)) + struct.pack(
+        f"!{len(game_ids)}I", *game_ids
+    )
+    return encode_frame(FRAME_INFO_REQUEST, payload)
+
+
+def decode_info_request(payload):
+    """Return (request ID, list of game IDs)."""
+    if len(payload) < INFO_REQUEST.size:
+        raise ProtocolError(f"Info request too short: {len(payload)} bytes")
+    request_id, count = INFO_REQUEST.unpack_from(payload)
+    if len(payload) != INFO_REQUEST.size + count * GAME_ID.size or count > MAX_INFO_IDS:
+        raise ProtocolError(
+            f"Info request {request_id} claims {count} game IDs"
+            f" in {len(payload)} bytes"
+        )
+    game_ids = struct.unpack_from(f"!{count}I", payload, INFO_REQUEST.size)
+    return request_id, list(game_ids)
+
+
+def encode_info_response(request_id, body):
+    return encode_frame(FRAME_INFO_RESPONSE, INFO_RESPONSE.pack(request_id) + body)
+
+
+def encode_info_error(request_id, message):
+    return encode_frame(
+        FRAME_INFO_ERROR, INFO_RESPONSE.pack(request_id) + message.encode()
+    )
+
+
+def decode_info_response(payload):
+    """Return (request ID, body bytes) of a response or error frame."""
+    return INFO_RESPONSE.unpack_from(payload)[0], payload[INFO_RESPONSE.size :]
@@ -0,0 +1,73 @@
+import socket
+import struct
+import time
+
+# A session log is a magic line followed by records, each a fixed header and
+# the message bytes. Times are monotonic seconds since the recording started.
+MAGIC = b"COGNITO-REC 1\n"
+RECORD = struct.Struct("!dBB4sHI")  # time, direction, channel, IPv4, port, length
+
+INBOUND = 0  # Client -> server
+OUTBOUND = 1  # Server -> client
+
+UDP = 0  # One game datagram
+TCP = 1  # Bytes read from an FPGA stream, frame boundaries as they arrived
+
+
+class Recorder:
+    """Appends every message the server sees or sends to a session log.
+
+    Writes go to a buffered file on the event loop thread, a record costs a
+    struct pack and a memory copy until the buffer fills."""
+
+    def __init__(self, path, buffer_size=1 << 16):
+        self.path = path
+        self.file = open(path, "ab", buffering=buffer_size)
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        self.started = time.monotonic()
+        self.records = 0
+
+    def record(self, direction, channel, addr, data):
+        header = RECORD.pack(
+            time.monotonic() - self.started,
+            direction,
+            channel,
+            socket.inet_aton(addr[0]),
+            addr[1],
+            len(data),
+        )
+        self.file.write(header)
+        self.file.write(data)
+        self.records += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def read_records(path):
+    """Yield (time, direction, channel, (IP, port), data) from a session log.
+
+    A log appended to by several runs restarts its clock at each run, times
+    are made to keep increasing across them. A record cut short by a crash
+    ends the log."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a session log")
+    offset = len(MAGIC)
+    base = last = 0.0
+    while offset + RECORD.size <= len(data):
+        t, direction, channel, ip, port, length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        if offset + length > len(data):
+            return
+        payload = data[offset : offset + length]
+        offset += length
+        if base + t < last:
+            base = last  # A later run appended to the same log
+        last = base + t
+        yield last, direction, channel, (socket.inet_ntoa(ip), port), payload
@@ -0,0 +1,140 @@
+import threading
+import time
+
+# Control messages carry their own sequence number in the header and are
+# acknowledged with an ACK naming the newest one received and a bit per each of
+# the ACK_WINDOW before it, so one ACK covers every recent loss at once.
+# Messages are delivered as they arrive, a lost one never holds up the rest.
+ACK_WINDOW = 32
+WINDOW_MASK = (1 << ACK_WINDOW) - 1
+
+# Retransmit timeout, from the smoothed round trip time as in RFC 6298
+INITIAL_RTO = 0.5  # Seconds, before the first RTT sample
+MIN_RTO = 0.1
+MAX_RTO = 2.0
+MAX_ATTEMPTS = 10  # Transmissions before a message is given up on
+
+
+class RttEstimator:
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = 0.0
+        self.rto = INITIAL_RTO
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, MIN_RTO), MAX_RTO)
+
+
+class ReliableChannel:
+    """Both ends of the control channel to any number of peers: retransmits
+    what we sent until it is acked, and drops duplicates of what we already
+    delivered. Shared between threads on the client, hence the lock."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # addr -> {seq: [data, first sent, last sent, transmissions]}
+        self.pending = {}
+        self.rtt = {}  # addr -> RttEstimator
+        self.windows = {}  # addr -> (newest seq received, bits for those before)
+        self.retransmits = 0
+        self.given_up = 0
+
+    def sent(self, addr, seq, data, now=None):
+        """Track a control message until addr acknowledges it."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.pending.setdefault(addr, {})[seq] = [data, now, now, 1]
+
+    def acknowledge(self, addr, newest, bits, now=None):
+        """Handle an ACK from addr, return the number of messages it settled."""
+        now = time.monotonic() if now is None else now
+        settled = 0
+        with self.lock:
+            pending = self.pending.get(addr, {})
+            for seq in list(pending):
+                behind = newest - seq
+                acked = 0 < behind <= ACK_WINDOW and bits >> behind - 1 & 1
+                if behind == 0 or acked:
+                    _, first_sent, _, attempts = pending.pop(seq)
+                    if attempts == 1:  # Karn: a retransmitted one can't be timed
+                        self.estimator(addr).sample(now - first_sent)
+                    settled += 1
+            if not pending:
+                self.pending.pop(addr, None)
+        return settled
+
+    def due(self, now=None):
+        """Messages whose retransmit timer ran out, as (data, addr) to resend."""
+        now = time.monotonic() if now is None else now
+        resend = []
+        with self.lock:
+            for addr, pending in list(self.pending.items()):
+                rto = self.estimator(addr).rto
+                for seq, entry in list(pending.items()):
+                    data, _, last_sent, attempts = entry
+                    if now - last_sent < min(rto * (1 << attempts - 1), MAX_RTO):
+                        continue
+                    if attempts >= MAX_ATTEMPTS:
+                        del pending[seq]
+                        self.given_up += 1
+                        continue
+                    entry[2] = now
+                    entry[3] = attempts + 1
+                    self.retransmits += 1
+                    resend.append((data, addr))
+                if not pending:
+                    del self.pending[addr]
+        return resend
+
+    def receive(self, addr, seq):
+        """Record a control message from addr. Returns whether it is new, and
+        the (newest, bits) to acknowledge it with, duplicate or not."""
+        with self.lock:
+            newest, bits = self.windows.get(addr, (None, 0))
+            if newest is None:
+                newest, new = seq, True
+            elif seq > newest:
+                ahead = seq - newest
+                bits = (bits << ahead | 1 << ahead - 1) & WINDOW_MASK
+                newest, new = seq, True
+            elif seq == newest:
+                new = False
+            elif newest - seq > ACK_WINDOW:
+                # Too old to tell whether it was delivered, so it is dropped.
+                # The window stays as it is, newest never moves backwards.
+                new = False
+            else:
+                behind = newest - seq
+                new = not bits >> behind - 1 & 1
+                bits |= 1 << behind - 1
+            self.windows[addr] = (newest, bits)
+        return new, newest, bits
+
+    def restart(self, addr):
+        """Expect a fresh sequence from addr, e.g. from a room we just joined,
+        whose numbers may be below the ones seen before."""
+        with self.lock:
+            self.windows.pop(addr, None)
+
+    def peers(self):
+        with self.lock:
+            return set(self.pending) | set(self.rtt) | set(self.windows)
+
+    def forget(self, addr):
+        """Drop everything about a peer that went away."""
+        with self.lock:
+            self.pending.pop(addr, None)
+            self.rtt.pop(addr, None)
+            self.windows.pop(addr, None)
+
+    def estimator(self, addr):
+        estimator = self.rtt.get(addr)
+        if estimator is None:
+            estimator = self.rtt[addr] = RttEstimator()
+        return estimator
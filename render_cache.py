@@ -0,0 +1,59 @@
+from collections import OrderedDict
+
+import pygame
+
+
+class RotationCache:
+    """Rotated copies of filled rectangles, made on first use.
+
+    Keyed by rectangle size, color and the angle rounded to step degrees,
+    finer than the eye can tell apart at these sizes. Least recently used
+    copies are evicted once their pixels take more than max_bytes."""
+
+    def __init__(self, step=0.5, max_bytes=32 << 20):
+        self.step = step
+        self.max_bytes = max_bytes
+        self.surfaces = OrderedDict()  # (size, color, angle steps) -> Surface
+        self.nbytes = 0
+
+    def get(self, size, color, angle):
+        key = (size, color, round(angle / self.step))
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            return surface
+
+        rect = pygame.Surface(size, pygame.SRCALPHA)
+        rect.fill(color)
+        surface = pygame.transform.rotate(rect, key[2] * self.step)
+        self.surfaces[key] = surface
+        self.nbytes += surface_bytes(surface)
+        while self.nbytes > self.max_bytes and len(self.surfaces) > 1:
+            _, evicted = self.surfaces.popitem(last=False)
+            self.nbytes -= surface_bytes(evicted)
+        return surface
+
+
+class TextCache:
+    """Rendered text surfaces by (font, string, color), so text that stays
+    the same from frame to frame is rasterised once. Holds the max_entries
+    most recently used."""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.surfaces = OrderedDict()  # (font, text, color) -> Surface
+
+    def render(self, font, text, color):
+        key = (font, text, color)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            return surface
+        surface = self.surfaces[key] = font.render(text, True, color)
+        if len(self.surfaces) > self.max_entries:
+            self.surfaces.popitem(last=False)
+        return surface
+
+
+def surface_bytes(surface):
+    return surface.get_width() * surface.get_height() * surface.get_bytesize()
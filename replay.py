@@ -0,0 +1,156 @@
+"""Replay a session log recorded by the game server (RECORD_PATH).
+
+    python replay.py info session.log
+    python replay.py server session.log --speed 10
+    python replay.py client session.log --speed 1
+
+"server" sends the recorded client traffic to a game server, one socket per
+recorded client so the server sees the same set of players. "client" acts
+as the server towards one pygame client: it waits for the client's first
+datagram, then sends it what the server sent one recorded client. --speed
+scales the recorded timing, 0 sends as fast as possible.
+"""
+
+import argparse
+import asyncio
+import time
+
+from protocol import peek_name
+from recording import INBOUND, OUTBOUND, TCP, UDP, read_records
+
+
+async def paced(records, speed):
+    """Yield records at their recorded times divided by speed."""
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    first = records[0][0] if records else 0.0
+    for i, record in enumerate(records):
+        if speed:
+            delay = start + (record[0] - first) / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elif i % 64 == 0:
+            await asyncio.sleep(0)  # Let replies be read between bursts
+        yield record
+
+
+class ReplayClient(asyncio.DatagramProtocol):
+    """Stands in for one recorded client, counting what the server answers."""
+
+    def __init__(self):
+        self.replies = 0
+
+    def datagram_received(self, data, addr):
+        self.replies += 1
+
+
+async def replay_to_server(records, args):
+    loop = asyncio.get_running_loop()
+    records = [r for r in records if r[1] == INBOUND]
+    udp = {}  # recorded client address -> (transport, ReplayClient)
+    tcp = {}  # recorded FPGA address -> stream writer
+    for _, _, channel, addr, _ in records:
+        if channel == UDP and addr not in udp:
+            udp[addr] = await loop.create_datagram_endpoint(
+                ReplayClient, remote_addr=(args.host, args.udp_port)
+            )
+        elif channel == TCP and addr not in tcp:
+            _, tcp[addr] = await asyncio.open_connection(args.host, args.tcp_port)
+
+    async for _, _, channel, addr, data in paced(records, args.speed):
+        if channel == UDP:
+            udp[addr][0].sendto(data)
+        else:
+            tcp[addr].write(data)
+
+    await asyncio.sleep(args.linger)  # Replies to the last messages
+    for writer in tcp.values():
+        await writer.drain()
+        writer.close()
+    for transport, _ in udp.values():
+        transport.close()
+    return len(records), sum(client.replies for _, client in udp.values())
+
+
+class ReplayServer(asyncio.DatagramProtocol):
+    """Waits for a client to say anything, then plays the server's side."""
+
+    def __init__(self):
+        self.client = asyncio.get_running_loop().create_future()
+        self.received = 0
+
+    def datagram_received(self, data, addr):
+        self.received += 1
+        if not self.client.done():
+            self.client.set_result(addr)
+
+
+async def replay_to_client(records, args):
+    loop = asyncio.get_running_loop()
+    records = [r for r in records if r[1] == OUTBOUND and r[2] == UDP]
+    if args.as_client:
+        host, port = args.as_client.rsplit(":", 1)
+        recorded = (host, int(port))
+    else:
+        recorded = records[0][3] if records else None  # First client served
+    records = [r for r in records if r[3] == recorded]
+
+    transport, server = await loop.create_datagram_endpoint(
+        ReplayServer, local_addr=(args.host, args.udp_port)
+    )
+    print(f"Standing in for the server towards {recorded}, port {args.udp_port}")
+    client = await server.client
+    async for _, _, _, _, data in paced(records, args.speed):
+        transport.sendto(data, client)
+    await asyncio.sleep(args.linger)
+    transport.close()
+    return len(records), server.received
+
+
+def summarize(records):
+    counts = {}
+    for _, direction, channel, _, data in records:
+        name = peek_name(data) if channel == UDP else "FPGA_STREAM"
+        key = ("in" if direction == INBOUND else "out", name)
+        counts[key] = counts.get(key, 0) + 1
+    duration = records[-1][0] - records[0][0] if records else 0.0
+    clients = {addr for _, _, _, addr, _ in records}
+    print(f"{len(records)} records over {duration:.1f}s, {len(clients)} addresses")
+    for (direction, name), count in sorted(counts.items()):
+        print(f"  {direction:4} {name:16} {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("mode", choices=["info", "server", "client"])
+    parser.add_argument("log", help="Session log written by the game server")
+    parser.add_argument(
+        "--host", default="127.0.0.1", help="Server to replay to, or address to bind"
+    )
+    parser.add_argument("--udp-port", type=int, default=12345)
+    parser.add_argument("--tcp-port", type=int, default=12000)
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="Time scale, 0 for as fast as possible"
+    )
+    parser.add_argument(
+        "--as-client", metavar="IP:PORT", help="Recorded client to stand in for"
+    )
+    parser.add_argument(
+        "--linger", type=float, default=1.0, help="Seconds to wait for late replies"
+    )
+    args = parser.parse_args()
+
+    records = list(read_records(args.log))
+    if args.mode == "info":
+        summarize(records)
+        return
+
+    replay = replay_to_server if args.mode == "server" else replay_to_client
+    started = time.perf_counter()
+    sent, received = asyncio.run(replay(records, args))
+    elapsed = time.perf_counter() - started - args.linger
+    print(f"Replayed {sent} messages in {elapsed:.2f}s, {received} received back")
+
+
+if __name__ == "__main__":
+    main()
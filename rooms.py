@@ -0,0 +1,197 @@
+import random
+import time
+from collections import deque
+
+from protocol import FLAG_ATTACK, FLAG_GREEN
+
+BOSS_MAX_HP = 3000
+DEFAULT_ROOM_ID = 0
+
+# Accelerometer range reported by the FPGA boards
+X_MIN, X_MAX = 0, 7000
+Y_MIN, Y_MAX = 0, 7000
+X_MID = (X_MIN + X_MAX) / 2
+Y_MID = (Y_MIN + Y_MAX) / 2
+
+# Snapshots kept as delta baselines for clients that acknowledge late
+SNAPSHOT_HISTORY = 32
+# Deltas sent to a member without an ack before it only gets keyframes
+UNACKED_DELTA_LIMIT = 30
+
+
+class Room:
+    """State for one game session: two players fighting one boss."""
+
+    def __init__(self, room_id):
+        self.room_id = room_id
+        self.members = {}  # (IP, Port) -> player ID
+        self.addresses = ()  # Member addresses, rebuilt on join and leave
+        self.players_ready = set()
+        self.boss_hp = BOSS_MAX_HP
+        self.overlay_angle = random.randint(-45, 45)
+        self.scores = {1: 0, 2: 0}
+        self.final_health = {1: 100, 2: 100}
+        self.game_running = False
+        # Sequence number of the last control message sent to the room. Starts
+        # anywhere so clients don't take a recreated room's messages for
+        # duplicates of the old one's.
+        self.seq = random.getrandbits(31)
+        self.angles = {1: 0, 2: 0}  # Tenths of a degree, -450 to 450
+        self.flags = 0
+        self.sent_flags = 0  # Flags as of the last snapshot
+        self.dirty = False  # State changed since the last snapshot went out
+        # Sequence number of the newest snapshot, random like seq so a client
+        # can tell a recreated room's snapshots from the old one's
+        self.snapshot_seq = random.getrandbits(31)
+        self.history = {}  # Snapshot sequence number -> snapshot state
+        self.history_order = deque()
+        self.acked = {}  # (IP, Port) -> newest snapshot the client acknowledged
+        self.last_seen = {}  # (IP, Port) -> time the client was last heard from
+        self.unacked = {}  # (IP, Port) -> deltas sent since the client last acked
+
+    def next_seq(self):
+        self.seq += 1
+        return self.seq
+
+    def join(self, addr, player_id):
+        """Add a member, return the addresses it replaced. A relaunched client
+        rejoins with the same player ID from a new port."""
+        replaced = [a for a, p in self.members.items() if p == player_id and a != addr]
+        for old_addr in replaced:
+            self.leave(old_addr)
+        self.members[addr] = player_id
+        self.addresses = tuple(self.members)
+        self.players_ready.add(player_id)
+        self.touch(addr)
+        return replaced
+
+    def leave(self, addr):
+        self.members.pop(addr, None)
+        self.addresses = tuple(self.members)
+        self.acked.pop(addr, None)
+        self.last_seen.pop(addr, None)
+        self.unacked.pop(addr, None)
+
+    def touch(self, addr):
+        if addr in self.members:
+            self.last_seen[addr] = time.monotonic()
+
+    def idle_members(self, now, timeout):
+        return [addr for addr, seen in self.last_seen.items() if now - seen > timeout]
+
+    def reset(self):
+        """Start a fresh round with the same members."""
+        self.boss_hp = BOSS_MAX_HP
+        self.scores[1] = self.scores[2] = 0
+        self.final_health = {1: 100, 2: 100}
+        self.game_running = True
+        self.players_ready.clear()
+        self.flags &= ~(FLAG_ATTACK[1] | FLAG_ATTACK[2])
+        self.dirty = True
+
+    def set_position(self, player_id, x, y):
+        self.angles[player_id] = round((x - X_MID) / (X_MAX - X_MIN) * 900)
+        if y > Y_MID:
+            self.flags |= FLAG_GREEN[player_id]
+        else:
+            self.flags &= ~FLAG_GREEN[player_id]
+        self.dirty = True
+
+    def set_attack(self, player_id, attacking):
+        if attacking:
+            self.flags |= FLAG_ATTACK[player_id]
+        elif self.sent_flags & FLAG_ATTACK[player_id]:
+            # Only clear an attack once a snapshot has carried it to clients
+            self.flags &= ~FLAG_ATTACK[player_id]
+
+    def record_snapshot(self):
+        """Take a new snapshot if anything changed, return the newest one."""
+        if self.dirty:
+            self.dirty = False
+            state = self.snapshot()
+            if state == self.history.get(self.snapshot_seq):
+                return state  # Marked dirty, but every field is as it was
+            self.snapshot_seq += 1
+            self.history[self.snapshot_seq] = state
+            self.history_order.append(self.snapshot_seq)
+            if len(self.history_order) > SNAPSHOT_HISTORY:
+                del self.history[self.history_order.popleft()]
+        return self.history.get(self.snapshot_seq)
+
+    def acknowledge(self, addr, seq):
+        if seq in self.history and seq > self.acked.get(addr, 0):
+            self.acked[addr] = seq
+        self.unacked.pop(addr, None)
+
+    def baseline_for(self, addr):
+        """Newest snapshot the client is known to have, as (seq, state)."""
+        seq = self.acked.get(addr, 0)
+        state = self.history.get(seq)
+        return (seq, state) if state is not None else (0, None)
+
+    def snapshot(self):
+        """Fields of the SNAPSHOT message describing the room right now."""
+        self.sent_flags = self.flags
+        return (
+            self.boss_hp,
+            self.overlay_angle,
+            self.scores[1],
+            self.scores[2],
+            self.angles[1],
+            self.angles[2],
+            self.flags,
+        )
+
+    def is_empty(self):
+        return not self.members
+
+
+class RoomRegistry:
+    """Maps room IDs to rooms and client addresses to the room they joined."""
+
+    def __init__(self):
+        self.rooms = {}
+        self.client_rooms = {}  # (IP, Port) -> Room
+
+    def get(self, room_id):
+        room = self.rooms.get(room_id)
+        if room is None:
+            room = self.rooms[room_id] = Room(room_id)
+        return room
+
+    def join(self, addr, room_id, player_id):
+        previous = self.client_rooms.get(addr)
+        if previous is not None and previous.room_id != room_id:
+            self.leave(addr)
+        room = self.get(room_id)
+        for old_addr in room.join(addr, player_id):
+            self.client_rooms.pop(old_addr, None)
+        self.client_rooms[addr] = room
+        return room
+
+    def leave(self, addr):
+        room = self.client_rooms.pop(addr, None)
+        if room is None:
+            return
+        room.leave(addr)
+        if room.is_empty():
+            del self.rooms[room.room_id]
+
+    def room_of(self, addr):
+        return self.client_rooms.get(addr)
+
+    def expire_idle(self, timeout):
+        """Drop members not heard from for timeout seconds, and with them any
+        room left empty. Returns the number of members dropped."""
+        now = time.monotonic()
+        expired = [
+            addr
+            for room in self.rooms.values()
+            for addr in room.idle_members(now, timeout)
+        ]
+        for addr in expired:
+            self.leave(addr)
+        return len(expired)
+
+    def running_rooms(self):
+        return [room for room in self.rooms.values() if room.game_running]
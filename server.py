@@ -1,129 +1,201 @@
-import socket
-import threading
-import boto3
+import asyncio
 import json
-import decimal
+import logging
+import os
+
+from cache import TTLCache
+from logs import setup_logging
+from metrics import port_from_env, registry
+from protocol import (
+    FRAME_EXIT,
+    FRAME_INFO_REQUEST,
+    FRAME_SAMPLES,
+    SAMPLE,
+    FrameReader,
+    ProtocolError,
+    decode_info_request,
+    encode_info_error,
+    encode_info_response,
+)
+from storage import open_storage
+
+log = logging.getLogger(__name__)
 
 HOST = "0.0.0.0" #listens to all available networks interfaces
 PORT = 12000 #port number where the server listens for incoming connections - changed from 12345
+# Pending connections the kernel queues before accept, capped by net.core.somaxconn
+BACKLOG = int(os.environ.get("INFO_SERVER_BACKLOG", 4096))
+# Plaintext metrics, local only. Kept clear of node_exporter's 9100 and of the
+# game server's ports (19100 + worker index), METRICS_PORT=0 turns them off.
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = port_from_env(19090)
+
+clients = set() #stream writers of connected clients
+
+# Storage setup, STORAGE_BACKEND picks DynamoDB (default) or local SQLite
+storage = open_storage()
+
+# Encoded responses by game ID, the catalog almost never changes
+info_cache = TTLCache(max_entries=4096, ttl=300.0, negative_ttl=30.0)
+NOT_FOUND = json.dumps({"error": "Game ID not found"}).encode()
+
+SAMPLE_DATA = [
+    {"game_id": 1, "name": "Block Blast", "players": 1, "genre": "Puszzle"},
+    {"game_id": 2, "name": "Dragon Quest", "players": 1, "genre": "RPG"},
+    {"game_id": 3, "name": "CSGO", "players": 10, "genre": "FPS"}
+]
+
+# Create the tables and insert whatever sample data is missing. Safe to run on
+# every start, a bootstrapped database is left untouched.
+def bootstrap_sample_data():
+    storage.create_tables()
+    existing = storage.batch_get_game_info([game["game_id"] for game in SAMPLE_DATA])
+    missing = [game for game in SAMPLE_DATA if game["game_id"] not in existing]
+    if not missing:
+        return
+
+    storage.insert_game_info(missing)
+    for game in missing:
+        invalidate_game_info(game["game_id"])
+
+    log.info("Sample data inserted (%d games).", len(missing))
+
+# Drop a cached response after the catalog entry changed
+def invalidate_game_info(game_id):
+    info_cache.invalidate(int(game_id))
+
+# Fetch many game infos with one storage round trip for all the cache misses,
+# as encoded response bytes by game ID
+def fetch_game_infos(game_ids):
+    responses, missing = cached_game_infos(game_ids)
+    if missing:
+        responses.update(load_game_infos(missing))
+    return responses
+
+# Split game IDs into cached responses and the IDs that have to be loaded
+def cached_game_infos(game_ids):
+    responses = {}
+    missing = []
+    for game_id in game_ids:
+        response = info_cache.get(game_id)
+        if response is not None:
+            responses[game_id] = response
+        else:
+            missing.append(game_id)
+    return responses, missing
 
-clients = [] #list of connected clients
-
-# AWS DynamoDB Setup
-dynamodb = boto3.resource('dynamodb', region_name="us-east-1")
-table_name = "GameInfo"
-
-def create_sample_table():
-    existing_tables = [table.name for table in dynamodb.tables.all()]
-    
-    if table_name not in existing_tables:
-        table = dynamodb.create_table(
-            TableName=table_name,
-            KeySchema=[
-                {'AttributeName': 'game_id', 'KeyType': 'HASH'}  # Partition key
-            ],
-            AttributeDefinitions=[
-                {'AttributeName': 'game_id', 'AttributeType': 'N'}
-            ],
-            ProvisionedThroughput={'ReadCapacityUnits': 10, 'WriteCapacityUnits': 10}
-        )
-        table.wait_until_exists()
-        print("Table created successfully!")
-
-# Insert sample data
-def insert_sample_data():
-    table = dynamodb.Table(table_name)
-    sample_data = [
-        {"game_id": 1, "name": "Block Blast", "players": 1, "genre": "Puszzle"},
-        {"game_id": 2, "name": "Dragon Quest", "players": 1, "genre": "RPG"},
-        {"game_id": 3, "name": "CSGO", "players": 10, "genre": "FPS"}
-    ]
-
-    for game in sample_data:
-        table.put_item(Item=game)
-
-    print("Sample data inserted.")
-
-#converting decimal to int or float since python is not compatible with decimal for JSON
-def decimal_converter(obj):
-    if isinstance(obj, decimal.Decimal):
-        return int(obj) if obj % 1 == 0 else float(obj)
-
-# Fetch game info
-def fetch_game_info(game_id):
-    table = dynamodb.Table(table_name)
+# Load cache misses from storage in one batch and cache them. Blocking.
+def load_game_infos(game_ids):
     try:
-        response = table.get_item(Key={'game_id': int(game_id)})
-        if 'Item' in response:
-            return json.dumps(response['Item'], default=decimal_converter)
-        else:
-            return json.dumps({"error": "Game ID not found"})
+        with registry.timer("storage.batch_get_game_info"):
+            items = storage.batch_get_game_info(game_ids)
     except Exception as e:
-        return json.dumps({"error": str(e)})
-
-#threaded function that manages communicate with a client
-def handle_client(conn, addr):
-    print(f"Client {addr} connected.")
-    clients.append(conn)
-
-    try: 
-        with conn:
-            print(f"Connected by {addr}")
-
-            #receiving data from clients
-            while True:
-                data = conn.recv(1024).decode("utf-8")
-                print(f"Receiving")
-                print(data)
-                if not data:
-                    break
-                    
-                print(f"Data is coming through: {data}")
-                try:
-                    game_id = int(data)
-                    response = fetch_game_info(data)
-                    conn.send(response.encode())
-                                            
-                except ValueError:
-                    #Its FPGA Data
-                    print(f"FPGA Data from {addr}: {data}")
-                        
-                
-
-                if data.lower() == "exit":
-                    print(f"Client {addr} requested exit.")
+        error = json.dumps({"error": str(e)}).encode()
+        return {game_id: error for game_id in game_ids}
+    responses = {}
+    for game_id in game_ids:
+        item = items.get(game_id)
+        if item is not None:
+            response = json.dumps(item).encode()
+            info_cache.put(game_id, response)
+        else:
+            response = NOT_FOUND
+            info_cache.put(game_id, response, negative=True)
+        responses[game_id] = response
+    return responses
+
+# One JSON object keyed by game ID, pieced together from the cached encodings
+def encode_game_infos(responses):
+    return b"{" + b",".join(
+        b'"%d":%s' % (game_id, response) for game_id, response in responses.items()
+    ) + b"}"
+
+# Answer one info request frame, a malformed one gets an error frame back.
+# Cache hits are answered on the loop, only misses wait on storage.
+async def answer_info_request(payload):
+    try:
+        request_id, game_ids = decode_info_request(payload)
+    except ProtocolError as e:
+        request_id = int.from_bytes(payload[:4], "big") if len(payload) >= 4 else 0
+        return encode_info_error(request_id, str(e))
+    responses, missing = cached_game_infos(game_ids)
+    if missing:
+        loop = asyncio.get_running_loop()
+        responses.update(await loop.run_in_executor(None, load_game_infos, missing))
+    body = encode_game_infos({game_id: responses[game_id] for game_id in game_ids})
+    return encode_info_response(request_id, body)
+
+#coroutine that manages communication with a client, an idle client costs no thread
+async def handle_client(reader, writer):
+    addr = writer.get_extra_info("peername")
+    clients.add(writer)
+
+    try:
+        #receiving framed messages from clients, requests may be pipelined
+        frames = FrameReader()
+        running = True
+        while running:
+            data = await reader.read(4096)
+            if not data:
+                break
+
+            responses = []
+            for kind, payload in frames.feed(data):
+                if kind == FRAME_INFO_REQUEST:
+                    registry.count("in", "INFO_REQUEST", len(payload))
+                    with registry.timer("INFO_REQUEST"):
+                        responses.append(await answer_info_request(payload))
+                elif kind == FRAME_SAMPLES:
+                    samples = len(payload) // SAMPLE.size
+                    registry.count("in", "FPGA_SAMPLE", len(payload), samples)
+                    # FPGA data is for the game server
+                elif kind == FRAME_EXIT:
+                    log.debug("Client %s requested exit.", addr)
+                    running = False
                     break
+            # Answer everything that arrived together in one send
+            if responses:
+                data = b"".join(responses)
+                registry.count("out", "INFO_RESPONSE", len(data), len(responses))
+                writer.write(data)
+                await writer.drain()
 
-                    #broadcasting messages to other clients
-                    #for client in clients:
-                        #if client != conn:
-                            #client.sendall(f"Client {addr}: {data}".encode("utf-8"))
-                            
     except Exception as e:
-        print(f"Error handling client {addr}: {e}")
-        
+        log.warning("Error handling client %s: %s", addr, e)
 
     finally:
-        print(f"Client {addr} disconnected.")
-        clients.remove(conn)
-        conn.close()
+        clients.discard(writer)
+        writer.close()
+
+
+# Tables and sample data are set up in the background, serving starts at once
+async def bootstrap():
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(None, bootstrap_sample_data)
+    except Exception as e:
+        log.error("Sample data bootstrap failed: %s", e)
+
+
+async def main():
+    server = await asyncio.start_server(handle_client, HOST, PORT, backlog=BACKLOG)
+    log.info("Server listening on %s:%d (backlog %d)", HOST, PORT, BACKLOG)
+
+    metrics = registry.start(METRICS_HOST, METRICS_PORT)
+    try:
+        async with server:
+            await asyncio.gather(server.serve_forever(), bootstrap())
+    finally:
+        if metrics is not None:
+            metrics.cancel()
 
 
 def start_server():
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
-        server_socket.bind((HOST, PORT))
-        server_socket.listen(2)
-        print(f"Server listening on {HOST}:{PORT}")
-
-        create_sample_table()
-        insert_sample_data()   
-
-        while True:
-            connection_socket, caddr = server_socket.accept()
-            print(f"Connection from {caddr}")
-            threading.Thread(
-                target=handle_client, args=(connection_socket, caddr), daemon=True
-            ).start()
+    setup_logging()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
 
 
 if __name__ == "__main__":
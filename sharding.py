@@ -0,0 +1,85 @@
+import hashlib
+import logging
+import multiprocessing
+import signal
+import socket
+import struct
+import sys
+import time
+
+log = logging.getLogger(__name__)
+
+FORWARD_HOST = "127.0.0.1"
+FORWARD_BASE_PORT = 13000  # Worker i listens for forwarded datagrams on base + i
+
+# Envelope put in front of a datagram handed to the worker that owns its room
+FORWARD_HEADER = struct.Struct("!B4sH")  # kind, client IPv4, client port
+FORWARD_CLIENT_DATAGRAM = 0
+FORWARD_FPGA_SAMPLE = 1
+FORWARD_GAME_RESULT = 2  # Finished game, shared so every worker ranks it
+
+
+def worker_for_room(room_id, num_workers):
+    """Rendezvous hash: every process computes the same owner for a room, and
+    a room only moves if its own worker slot disappears."""
+    if num_workers <= 1:
+        return 0
+    best_worker, best_weight = 0, b""
+    for worker in range(num_workers):
+        weight = hashlib.blake2b(
+            struct.pack("!II", room_id, worker), digest_size=8
+        ).digest()
+        if weight > best_weight:
+            best_worker, best_weight = worker, weight
+    return best_worker
+
+
+def forward_address(worker_index):
+    return (FORWARD_HOST, FORWARD_BASE_PORT + worker_index)
+
+
+def pack_forward(kind, addr, payload):
+    return FORWARD_HEADER.pack(kind, socket.inet_aton(addr[0]), addr[1]) + payload
+
+
+def unpack_forward(data):
+    kind, ip, port = FORWARD_HEADER.unpack_from(data)
+    return kind, (socket.inet_ntoa(ip), port), data[FORWARD_HEADER.size :]
+
+
+def run_workers(num_workers, target):
+    """Coordinator: fork one worker per slot running target(index, num_workers)
+    and restart any that die, so each slot keeps serving the same rooms."""
+    context = multiprocessing.get_context("fork")
+    workers = {}
+
+    def start(index):
+        process = context.Process(
+            target=target, args=(index, num_workers), name=f"game-worker-{index}"
+        )
+        process.start()
+        workers[index] = process
+        log.info("Started worker %d (pid %d)", index, process.pid)
+
+    # Shut the workers down cleanly when the coordinator itself is terminated
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    for index in range(num_workers):
+        start(index)
+
+    try:
+        while True:
+            time.sleep(1)
+            for index, process in list(workers.items()):
+                if not process.is_alive():
+                    log.warning(
+                        "Worker %d exited with %s, restarting", index, process.exitcode
+                    )
+                    start(index)
+    except KeyboardInterrupt:
+        log.info("Coordinator shutting down workers.")
+    finally:
+        for process in workers.values():
+            process.terminate()
+        for process in workers.values():
+            process.join()
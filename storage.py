@@ -0,0 +1,353 @@
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from decimal import Decimal
+
+log = logging.getLogger(__name__)
+
+SCORES_TABLE = "GameScores"
+INFO_TABLE = "GameInfo"
+BATCH_GET_LIMIT = 100  # Most keys a single BatchGetItem accepts
+
+# Global secondary index ordering every game by best score. All games share one
+# constant partition so a single Query walks the whole leaderboard in order.
+BEST_SCORE_INDEX = "BestScoreIndex"
+LEADERBOARD_PARTITION = "ALL"
+
+
+def convert_decimal(obj):
+    """DynamoDB returns numbers as Decimal, turn them back into ints/floats."""
+    if isinstance(obj, Decimal):
+        return int(obj) if obj % 1 == 0 else float(obj)
+    elif isinstance(obj, dict):
+        return {k: convert_decimal(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [convert_decimal(i) for i in obj]
+    return obj
+
+
+class Storage(ABC):
+    """Where game results and the game info catalog are kept."""
+
+    @abstractmethod
+    def create_tables(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_game_results(self, items):
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_game_results(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def top_game_results(self, limit):
+        """The limit games with the highest best score, best first."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_better_results(self, score, game_id):
+        """Number of games ranked above game_id, whose best score is score:
+        games with a higher best score, and older games with the same one."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_game_info(self, game_id):
+        """The catalog entry for game_id, or None if there is none."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def batch_get_game_info(self, game_ids):
+        """Catalog entries for many IDs at once, as a dict by game ID. IDs
+        with no entry are left out."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def insert_game_info(self, items):
+        raise NotImplementedError
+
+
+class DynamoDBStorage(Storage):
+    def __init__(self, region_name="us-east-1"):
+        import boto3
+        from boto3.dynamodb.conditions import Attr, Key
+
+        self.dynamodb = boto3.resource("dynamodb", region_name=region_name)
+        self.key = Key
+        self.attr = Attr
+
+    def _create_table(self, table_name, **extra):
+        existing_tables = [table.name for table in self.dynamodb.tables.all()]
+        if table_name in existing_tables:
+            return False
+        table = self.dynamodb.create_table(
+            TableName=table_name,
+            KeySchema=[{"AttributeName": "game_id", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "game_id", "AttributeType": "N"}]
+            + extra.pop("AttributeDefinitions", []),
+            ProvisionedThroughput={"ReadCapacityUnits": 10, "WriteCapacityUnits": 10},
+            **extra,
+        )
+        table.wait_until_exists()
+        log.info("%s table created successfully!", table_name)
+        return True
+
+    def _best_score_index(self):
+        return {
+            "IndexName": BEST_SCORE_INDEX,
+            "KeySchema": [
+                {"AttributeName": "leaderboard", "KeyType": "HASH"},
+                {"AttributeName": "best_score", "KeyType": "RANGE"},
+            ],
+            "Projection": {"ProjectionType": "ALL"},
+            "ProvisionedThroughput": {
+                "ReadCapacityUnits": 10,
+                "WriteCapacityUnits": 10,
+            },
+        }
+
+    def _index_attributes(self):
+        return [
+            {"AttributeName": "leaderboard", "AttributeType": "S"},
+            {"AttributeName": "best_score", "AttributeType": "N"},
+        ]
+
+    def _ensure_best_score_index(self):
+        """Add the index to a GameScores table created before it existed, and
+        fill in the index keys on the games already stored."""
+        table = self.dynamodb.Table(SCORES_TABLE)
+        indexes = table.global_secondary_indexes or []
+        if any(index["IndexName"] == BEST_SCORE_INDEX for index in indexes):
+            return
+        table.meta.client.update_table(
+            TableName=SCORES_TABLE,
+            AttributeDefinitions=self._index_attributes(),
+            GlobalSecondaryIndexUpdates=[{"Create": self._best_score_index()}],
+        )
+        log.info("Creating %s on %s, backfilling games.", BEST_SCORE_INDEX, SCORES_TABLE)
+        self.save_game_results(self.load_game_results())
+
+    def create_tables(self):
+        created = self._create_table(
+            SCORES_TABLE,
+            AttributeDefinitions=self._index_attributes(),
+            GlobalSecondaryIndexes=[self._best_score_index()],
+        )
+        if not created:
+            self._ensure_best_score_index()
+        self._create_table(INFO_TABLE)
+
+    def save_game_results(self, items):
+        table = self.dynamodb.Table(SCORES_TABLE)
+        with table.batch_writer() as batch:
+            for item in items:
+                item = dict(
+                    item,
+                    leaderboard=LEADERBOARD_PARTITION,
+                    best_score=max(item["player_1_score"], item["player_2_score"]),
+                )
+                batch.put_item(Item=item)
+
+    def top_game_results(self, limit):
+        table = self.dynamodb.Table(SCORES_TABLE)
+        response = table.query(
+            IndexName=BEST_SCORE_INDEX,
+            KeyConditionExpression=self.key("leaderboard").eq(LEADERBOARD_PARTITION),
+            ScanIndexForward=False,
+            Limit=limit,
+        )
+        items = convert_decimal(response.get("Items", []))
+        for item in items:
+            del item["leaderboard"], item["best_score"]  # Index keys only
+        return items
+
+    def count_better_results(self, score, game_id):
+        table = self.dynamodb.Table(SCORES_TABLE)
+        partition = self.key("leaderboard").eq(LEADERBOARD_PARTITION)
+        higher = {
+            "IndexName": BEST_SCORE_INDEX,
+            "KeyConditionExpression": partition & self.key("best_score").gt(score),
+            "Select": "COUNT",
+        }
+        older_ties = {
+            "IndexName": BEST_SCORE_INDEX,
+            "KeyConditionExpression": partition & self.key("best_score").eq(score),
+            "FilterExpression": self.attr("game_id").lt(int(game_id)),
+            "Select": "COUNT",
+        }
+        return self._count(table, higher) + self._count(table, older_ties)
+
+    def _count(self, table, kwargs):
+        count = 0
+        while True:
+            response = table.query(**kwargs)
+            count += response["Count"]
+            if "LastEvaluatedKey" not in response:
+                return count
+            kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def load_game_results(self):
+        table = self.dynamodb.Table(SCORES_TABLE)
+        response = table.scan()
+        yield from convert_decimal(response.get("Items", []))
+        while "LastEvaluatedKey" in response:
+            response = table.scan(ExclusiveStartKey=response["LastEvaluatedKey"])
+            yield from convert_decimal(response.get("Items", []))
+
+    def get_game_info(self, game_id):
+        table = self.dynamodb.Table(INFO_TABLE)
+        response = table.get_item(Key={"game_id": int(game_id)})
+        item = response.get("Item")
+        return convert_decimal(item) if item is not None else None
+
+    def batch_get_game_info(self, game_ids, max_retries=5, retry_delay=0.05):
+        found = {}
+        keys = [{"game_id": int(game_id)} for game_id in set(game_ids)]
+        for start in range(0, len(keys), BATCH_GET_LIMIT):
+            request = {INFO_TABLE: {"Keys": keys[start : start + BATCH_GET_LIMIT]}}
+            attempt = 0
+            while True:
+                response = self.dynamodb.batch_get_item(RequestItems=request)
+                for item in convert_decimal(response["Responses"].get(INFO_TABLE, [])):
+                    found[item["game_id"]] = item
+                request = response.get("UnprocessedKeys")  # Throttled keys
+                if not request:
+                    break
+                if attempt == max_retries:
+                    raise RuntimeError(
+                        f"{len(request[INFO_TABLE]['Keys'])} game info keys"
+                        " still unprocessed after retries"
+                    )
+                # Exponential backoff with jitter, as for game result writes
+                time.sleep(retry_delay * (2**attempt) * random.uniform(0.5, 1.5))
+                attempt += 1
+        return found
+
+    def insert_game_info(self, items):
+        table = self.dynamodb.Table(INFO_TABLE)
+        with table.batch_writer() as batch:
+            for item in items:
+                batch.put_item(Item=item)
+
+
+class SQLiteStorage(Storage):
+    """Embedded local database for LAN events and benchmarks."""
+
+    def __init__(self, path="cognito_hazards.db"):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.lock = threading.Lock()  # The write-behind thread shares the connection
+
+    def create_tables(self):
+        with self.lock, self.conn:
+            self.conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS game_scores (
+                    game_id INTEGER PRIMARY KEY,
+                    room_id INTEGER NOT NULL DEFAULT 0,
+                    player_1_score INTEGER NOT NULL,
+                    player_2_score INTEGER NOT NULL,
+                    best_score INTEGER NOT NULL,
+                    timestamp TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS game_scores_best_score
+                    ON game_scores (best_score DESC, game_id);
+                CREATE INDEX IF NOT EXISTS game_scores_timestamp
+                    ON game_scores (timestamp);
+                CREATE TABLE IF NOT EXISTS game_info (
+                    game_id INTEGER PRIMARY KEY,
+                    item TEXT NOT NULL
+                );
+                """
+            )
+
+    def save_game_results(self, items):
+        rows = [
+            (
+                item["game_id"],
+                item.get("room_id", 0),
+                item["player_1_score"],
+                item["player_2_score"],
+                max(item["player_1_score"], item["player_2_score"]),
+                item["timestamp"],
+            )
+            for item in items
+        ]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO game_scores VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+
+    def load_game_results(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT game_id, room_id, player_1_score, player_2_score, timestamp"
+                " FROM game_scores"
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def top_game_results(self, limit):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT game_id, room_id, player_1_score, player_2_score, timestamp"
+                " FROM game_scores ORDER BY best_score DESC, game_id LIMIT ?",
+                (limit,),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def count_better_results(self, score, game_id):
+        with self.lock:
+            # Games ranked ahead: a higher score, or the same score and an
+            # older game ID. Each subquery counts one range of the covering
+            # (best_score DESC, game_id) index, best_score > score and
+            # best_score = score AND game_id < game_id, and the counts are added.
+            row = self.conn.execute(
+                "SELECT (SELECT COUNT(*) FROM game_scores WHERE best_score > ?)"
+                " + (SELECT COUNT(*) FROM game_scores"
+                " WHERE best_score = ? AND game_id < ?)",
+                (score, score, game_id),
+            ).fetchone()
+        return row[0]
+
+    def get_game_info(self, game_id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT item FROM game_info WHERE game_id = ?", (int(game_id),)
+            ).fetchone()
+        return json.loads(row["item"]) if row is not None else None
+
+    def batch_get_game_info(self, game_ids):
+        game_ids = [int(game_id) for game_id in set(game_ids)]
+        placeholders = ",".join("?" * len(game_ids))
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT game_id, item FROM game_info"
+                f" WHERE game_id IN ({placeholders})",
+                game_ids,
+            ).fetchall()
+        return {row["game_id"]: json.loads(row["item"]) for row in rows}
+
+    def insert_game_info(self, items):
+        rows = [(item["game_id"], json.dumps(item)) for item in items]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO game_info VALUES (?, ?)", rows
+            )
+
+
+def open_storage():
+    """Pick the backend from STORAGE_BACKEND: "dynamodb" (default) or "sqlite"."""
+    backend = os.environ.get("STORAGE_BACKEND", "dynamodb").lower()
+    if backend == "sqlite":
+        return SQLiteStorage(os.environ.get("SQLITE_PATH", "cognito_hazards.db"))
+    if backend == "dynamodb":
+        return DynamoDBStorage(os.environ.get("AWS_REGION", "us-east-1"))
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}")
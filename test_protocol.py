@@ -0,0 +1,39 @@
+from protocol import (
+    FRAME_HEADER,
+    FRAME_SAMPLES,
+    MAX_FRAME_SAMPLES,
+    SAMPLE,
+    FrameReader,
+    encode_samples,
+    iter_samples,
+)
+
+
+def batch(n):
+    return [(i % 7001, (i * 7) % 7001, 1 + i % 2, i % 256) for i in range(n)]
+
+
+def decode(data):
+    frames = FrameReader().feed(data)
+    assert all(kind == FRAME_SAMPLES for kind, _ in frames)
+    return frames, [sample for _, p in frames for sample in iter_samples(p)]
+
+
+def test_batch_at_the_limit_is_one_frame():
+    samples = batch(MAX_FRAME_SAMPLES)
+    data = encode_samples(samples)
+    assert len(data) == FRAME_HEADER.size + MAX_FRAME_SAMPLES * SAMPLE.size
+    frames, decoded = decode(data)
+    assert len(frames) == 1
+    assert decoded == samples
+
+
+def test_batch_over_the_limit_is_split():
+    samples = batch(MAX_FRAME_SAMPLES * 2 + 1)
+    frames, decoded = decode(encode_samples(samples))
+    assert [len(p) // SAMPLE.size for _, p in frames] == [
+        MAX_FRAME_SAMPLES,
+        MAX_FRAME_SAMPLES,
+        1,
+    ]
+    assert decoded == samples